@@ -0,0 +1,183 @@
+"""
+Sample ring sitting between the decoding pipeline and the sound card callback.
+"""
+from collections import deque
+import numpy as np
+
+from pc_model.pc_metrics import LatencyHistogram
+
+class AudioRing():
+    """
+    Single producer / single consumer ring of audio samples that also acts as an
+    adaptive jitter buffer.
+
+    The pipeline write()s chunks of whatever size it has, the audio callback read()s
+    however many frames the sound card asks for. Each side only ever moves its own
+    index (total samples written / read) so no lock is needed between them.
+
+    The ring aims to hold about `target` samples whenever the callback comes
+    asking. Every underrun raises the target. A long stretch with no underruns
+    lets it fall back towards minTarget. When the fill wanders from the target,
+    playback is sped up or slowed down by `stretch` (a fraction of a percent)
+    until it is back. When it is far too full, it skips ahead. Nothing here
+    prints. What happened is counted and available from get_stats().
+
+    Chunks can be written with a capture time. When read() is told when its
+    samples will actually be played, the difference is recorded as the end to end
+    latency of the oldest sample in that read.
+
+    flush() throws away what's been written so far (audio from before a retune).
+    It can be called from any thread since the consumer does the skipping.
+    """
+    def __init__(self, capacity = 2**16, minTarget = 1024, maxTarget = 2**14, stretch = 1 / 128, decayAfter = 5 * 44100):
+        self.capacity   = capacity
+        self.minTarget  = minTarget
+        self.maxTarget  = min(maxTarget, capacity // 2)
+        self.stretch    = stretch
+        self.decayAfter = decayAfter # Samples played without an underrun before the target is lowered
+        self.target     = minTarget
+
+        self.underruns  = 0 # Callback wanted more than we had
+        self.overruns   = 0 # Pipeline wrote more than would fit (newest samples dropped)
+        self.skipped    = 0 # Samples thrown away to catch up
+        self.stretched  = 0 # Callbacks that played sped up or slowed down
+
+        self.__buf      = np.zeros(capacity, dtype=np.float32)
+        self.__scratch  = np.zeros(0, dtype=np.float32)
+        self.__w        = 0 # Only touched by the producer
+        self.__r        = 0 # Only touched by the consumer
+        self.__primed   = False
+        self.__sinceUnderrun = 0
+        self.__flushTo  = 0 # Write index to skip up to, set by flush(), acted on by the consumer
+        self.__stamps   = deque(maxlen=256) # (sample index, capture time), appended by producer, popped by consumer
+        self.latency    = LatencyHistogram()
+
+    def fill(self):
+        return self.__w - self.__r
+
+    def write(self, x, captureTime = None):
+        """
+        Producer side. Copies x into the ring, whatever doesn't fit is dropped.
+        captureTime (time.perf_counter()) is when x's first sample was captured.
+        """
+        n = min(len(x), self.capacity - self.fill())
+        if n < len(x):
+            self.overruns += 1
+        if captureTime is not None and n:
+            self.__stamps.append((self.__w, captureTime))
+
+        start = self.__w % self.capacity
+        first = min(n, self.capacity - start)
+        self.__buf[start:start + first] = x[:first]
+        self.__buf[:n - first] = x[first:n]
+        self.__w += n # Publish only once the samples are in place
+
+    def flush(self):
+        """
+        Drop every sample written so far. Takes effect on the next read().
+        """
+        self.__flushTo = self.__w
+
+    def __take(self, out, n):
+        start = self.__r % self.capacity
+        first = min(n, self.capacity - start)
+        out[:first] = self.__buf[start:start + first]
+        out[first:n] = self.__buf[:n - first]
+        self.__r += n
+
+    def __take_stretched(self, out, n):
+        # Pull n samples and linearly interpolate them onto len(out) samples
+        if len(self.__scratch) < n:
+            self.__scratch = np.zeros(n, dtype=np.float32)
+        src = self.__scratch[:n]
+        self.__take(src, n)
+        out[:] = np.interp(np.linspace(0, n - 1, len(out)), np.arange(n), src)
+        self.stretched += 1
+
+    def __record_latency(self, playTime):
+        # Latest stamp at or before the read index belongs to the first sample being played
+        stamps = self.__stamps
+        while len(stamps) > 1 and stamps[1][0] <= self.__r:
+            stamps.popleft()
+        if stamps and stamps[0][0] <= self.__r:
+            self.latency.record(max(0, int((playTime - stamps[0][1]) * 1e9)))
+
+    def read(self, out, playTime = None):
+        """
+        Consumer side. Fills out (1-D float32, any length) with the next samples.
+        playTime (time.perf_counter() clock) is when out[0] will come out of the DAC.
+        """
+        flushTo = self.__flushTo
+        if flushTo > self.__r:
+            # Wait for the ring to fill back up, without counting it as an underrun
+            self.skipped += flushTo - self.__r
+            self.__r = flushTo
+            self.__primed = False
+        if playTime is not None:
+            self.__record_latency(playTime)
+        frames = len(out)
+        avail  = self.fill()
+
+        # Refill to target before playing again after an underrun (or at startup)
+        if not self.__primed:
+            if avail < self.target + frames:
+                out[:] = 0
+                return
+            self.__primed = True
+
+        if avail < frames:
+            self.__take(out, avail)
+            out[avail:] = 0
+            self.underruns += 1
+            self.target = min(self.maxTarget, self.target + max(frames, self.minTarget // 2))
+            self.__primed = False
+            self.__sinceUnderrun = 0
+            return
+
+        excess = avail - frames - self.target
+        step   = max(1, int(frames * self.stretch))
+        if excess > self.target + frames:
+            # Hopelessly behind, jump forward instead of slowly catching up
+            self.__r += excess
+            self.skipped += excess
+            self.__take(out, frames)
+        elif excess > self.target // 4:
+            self.__take_stretched(out, frames + step)
+        elif excess < -(self.target // 4) and avail >= frames:
+            self.__take_stretched(out, frames - step)
+        else:
+            self.__take(out, frames)
+
+        self.__sinceUnderrun += frames
+        if self.__sinceUnderrun > self.decayAfter:
+            self.target = max(self.minTarget, self.target - self.minTarget // 4)
+            self.__sinceUnderrun = 0
+
+    def get_stats(self):
+        return {
+            "fill"      : self.fill(),
+            "target"    : self.target,
+            "underruns" : self.underruns,
+            "overruns"  : self.overruns,
+            "skipped"   : self.skipped,
+            "stretched" : self.stretched,
+            "latency"   : self.latency.summary(),
+        }
+
+
+def __testing():
+    ring = AudioRing(capacity=2**12, minTarget=256)
+    out  = np.zeros(300, dtype=np.float32)
+
+    # Jittery producer writing odd sized chunks, consumer reading fixed blocks
+    rng = np.random.default_rng(0)
+    # Pretend each read is played 300 samples (at 44.1k) after the previous one, captured 20 ms before being written
+    for i in range(2000):
+        now = i * 300 / 44100
+        if rng.random() < 0.9:
+            ring.write(np.full(rng.integers(100, 500), i, dtype=np.float32), captureTime=now - 0.02)
+        ring.read(out, playTime=now)
+    print(ring.get_stats())
+
+if __name__ == "__main__":
+    __testing()
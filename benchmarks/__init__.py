@@ -0,0 +1,3 @@
+"""
+Benchmarks for the decoding pipeline. See bench_pipeline.
+"""
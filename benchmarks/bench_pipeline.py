@@ -0,0 +1,273 @@
+"""
+Throughput of the decoding pipeline on synthetic IQ.
+
+Run from the repo root:
+
+    python -m benchmarks.bench_pipeline --chunks 4096 16384 65536 --out results.json
+
+Two kinds of measurement are made for every (dtype policy, signal, demod scheme,
+chunk size):
+- stage: Each stage of system_pipeline_stages is called directly, one after the
+         other on the same packets, so its cost is measured on realistic input
+         without any asyncio overhead. RechunkArray has a consume loop of its own, it's
+         handed one packet at a time and its blocks go back to its pool afterwards.
+- chain: The whole chain main runs (system_pipeline_stages.build_chain, with
+         stand ins for the dongle and speakers) is run through the pc_model,
+         which also counts scheduling, queues and rechunking. With --multiproc the channel filter / decimator
+         get their own process like they do in main.
+
+rtf (real time factor) is seconds of signal handled per second of wall time.
+Anything under 1 can't keep up with the dongle at that sample rate.
+samples_per_s counts samples going into the stage, which are at the decimated
+rate from DemodulateRF on.
+
+The squelch is held open so every stage does its full amount of work.
+
+--dtypes single double compares the float32 / complex64 pipeline against float64 /
+complex128 (see dtype_policy). Since most stages are bound by memory bandwidth the
+gap is widest on boards with little cache and slow memory, like the Pi.
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import platform
+import sys
+import time
+
+import numpy as np
+import scipy
+
+import param_types as ptys
+import system_pipeline_stages as sps
+from demodulation import DemodulationManager, DemodSchemes
+from pc_model import AsyncHandler, ProcessHandler, Graph, BaseProducer, AbstractWorker, AbstractWindow
+from streaming_dsp import PowerEstimator
+from buffer_pool import BufferPool
+from retune import RetuneScheduler
+from dtype_policy import POLICIES, set_policy, get_policy
+from benchmarks.synth_iq import SyntheticIQ, SIGNAL_KINDS
+
+DEFAULT_CHUNKS = [2**12, 2**14, 2**16, 2**18]
+
+def make_params(fs, bw, scheme, audioFs = 44100, audioChunk = 2**12, cf = 133.2e6):
+    """
+    Stand alone copies of the params the pipeline stages read (see main.init_params)
+    """
+    dmgr = DemodulationManager()
+    dmgr.set_demod_scheme(DemodSchemes[scheme])
+    params = {
+        "sdr_fs"        : ptys.NumericParam(fs, 0, 2e9, None),
+        "sdr_dig_bw"    : ptys.NumericParam(bw, 1e3, 240e3, [1]),
+        "sdr_decoder"   : ptys.ObjParam(dmgr),
+        "sdr_squelch"   : ptys.NumericParam(-200, -200, 2, [1]),
+        "spkr_volume"   : ptys.NumericParam(100, 0, 100, [1]),
+        "spkr_chunk_sz" : ptys.NumericParam(audioChunk, 1, None, [1]),
+        "spkr_fs"       : ptys.NumericParam(audioFs, 1, None, [1]),
+        "sdr_cf"        : ptys.NumericParam(cf, 30e6, 1766e6, [1]),
+        "sdr_channels"  : ptys.ObjParam([]),
+        "sdr_retuner"   : ptys.ObjParam(RetuneScheduler(lambda freq : None, hwFreq=cf)), # Never retunes, there's no dongle
+    }
+    params["sdr_lp_sos"] = ptys.ObjParam(dmgr.create_filter(params["sdr_dig_bw"], params["sdr_fs"]))
+    return params
+
+def make_stages(params):
+    """
+    Pipeline stages that work packet by packet, in pipeline order
+    """
+    return [
+        sps.MeasurePower(PowerEstimator.EWMA, stride=4),
+        sps.ApplySquelch(params["sdr_squelch"]),
+        sps.Filter(params["sdr_lp_sos"]),
+        sps.Decimate(params["sdr_fs"], params["sdr_dig_bw"]),
+        sps.DemodulateRF(params["sdr_decoder"]),
+        sps.Downsample(params["sdr_fs"], params["spkr_fs"]),
+        sps.RechunkArray(params["spkr_chunk_sz"], np.float32),
+        sps.AdjustVolume(params["spkr_volume"]),
+    ]
+
+class _Feed(BaseProducer):
+    """
+    Stands in for the previous stage of one with its own consume loop (RechunkArray)
+    """
+    async def produce(self):
+        pass
+
+def _step(stage, pdp, loop):
+    """
+    Packets out of stage for pdp going in (RechunkArray makes any number of them)
+    """
+    if isinstance(stage, AbstractWorker):
+        return [stage.process(pdp)]
+    if isinstance(stage, AbstractWindow):
+        stage.inspect(pdp)
+        return [pdp]
+    stage.source.outbox.put_nowait(pdp)
+    loop.run_until_complete(stage.consume())
+    out = []
+    while not stage.outbox.empty():
+        out.append(stage.outbox.get_nowait())
+    return out
+
+def _packets(chunks):
+    # Samples are converted to the dtype policy as they enter, same as the real sources do
+    policy = get_policy()
+    for x in chunks:
+        yield sps.PipelineDataPackage(data = x.astype(policy.complex), meta = {"t_capture" : time.perf_counter()})
+
+def bench_stages(chunks, params, warmup = 2):
+    """
+    Seconds spent and samples fed into each stage over all of chunks, plus how many
+    samples of raw IQ that was (stages after Decimate see fewer samples)
+    """
+    stages  = make_stages(params)
+    spent   = [0] * len(stages)
+    samples = [0] * len(stages)
+    raw     = 0
+    loop    = asyncio.new_event_loop()
+    for stage in stages:
+        if not isinstance(stage, (AbstractWorker, AbstractWindow)):
+            stage.register_source(_Feed())
+    for i, pdp in enumerate(_packets(chunks)):
+        if i >= warmup:
+            raw += len(pdp)
+        pdps = [pdp]
+        for s, stage in enumerate(stages):
+            n  = sum(len(p) for p in pdps)
+            t0 = time.perf_counter_ns()
+            pdps = [out for p in pdps for out in _step(stage, p, loop)]
+            if i >= warmup:
+                spent[s]   += time.perf_counter_ns() - t0
+                samples[s] += n
+        # Blocks go back to the pool like the speakers would hand them back
+        for stage in stages:
+            if isinstance(stage, sps.RechunkArray):
+                for p in pdps:
+                    if p.data is not stage.silence:
+                        stage.pool.release(p.data)
+    loop.close()
+    return [(type(stage).__name__, spent[s] / 1e9, samples[s], raw) for s, stage in enumerate(stages)]
+
+class _Replay(BaseProducer):
+    def __init__(self, chunks):
+        super().__init__()
+        self.chunks = chunks
+
+    async def produce(self):
+        for pdp in _packets(self.chunks):
+            await self.outbox.put(pdp)
+        await self.stop()
+
+class _Speakers():
+    """
+    Stands in for the SpeakerManager, takes every block and hands it straight back
+    """
+    def __init__(self, pool):
+        self.pool = pool
+
+    def feed(self, chunk, captureTime = None):
+        self.pool.release(chunk)
+
+def bench_chain(chunks, params, multiproc = False):
+    """
+    Wall time to push every chunk through the full chain, and the capture to
+    output latency percentiles of the last stage
+    """
+    audioPool = BufferPool((int(params["spkr_chunk_sz"]),), np.float32)
+    chain = sps.build_chain(_Replay(chunks), params, audioPool, _Speakers(audioPool), dropOldest=False)
+    if not multiproc:
+        chain = [(stage, None) for stage, _ in chain]
+
+    m = Graph()
+    m.add_linear_chain([stage for stage, _ in chain], [placement for _, placement in chain])
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    t0 = time.perf_counter()
+    slotBytes = max(len(x) for x in chunks) * get_policy().complex.itemsize # Whole chunks cross into the channel process
+    (ProcessHandler(m, ringSlotBytes=slotBytes) if multiproc else AsyncHandler(m)).run()
+    wall = time.perf_counter() - t0
+    loop.close()
+
+    latency = chain[-2][0].metrics.latency.summary()
+    return wall, latency
+
+def system_info():
+    info = {
+        "time"      : time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "platform"  : platform.platform(),
+        "machine"   : platform.machine(),
+        "cpu_count" : os.cpu_count(),
+        "python"    : platform.python_version(),
+        "numpy"     : np.__version__,
+        "scipy"     : scipy.__version__,
+    }
+    # Raspberry Pis (and most other boards) say what they are here
+    try:
+        with open("/proc/device-tree/model") as f:
+            info["model"] = f.read().strip("\x00\n")
+    except OSError:
+        pass
+    return info
+
+def run(fs, bw, chunkSizes, signals, schemes, seconds, multiproc = False, dtypes = ("single",)):
+    results = []
+    for chunkSize in chunkSizes:
+        count = max(4, int(np.ceil(seconds * fs / chunkSize)))
+        for kind in signals:
+            chunks = list(SyntheticIQ(fs, kind).chunks(chunkSize, count))
+            for scheme, dtype in itertools.product(schemes, dtypes):
+                set_policy(dtype)
+                case = {"dtype" : dtype, "signal" : kind, "scheme" : scheme, "chunk_size" : chunkSize, "fs" : fs, "bw" : bw}
+
+                for name, spent, samples, raw in bench_stages(chunks, make_params(fs, bw, scheme)):
+                    results.append(case | {
+                        "kind"          : "stage",
+                        "stage"         : name,
+                        "seconds"       : spent,
+                        "samples_in"    : samples,
+                        "samples_per_s" : samples / spent if spent else float("inf"),
+                        "rtf"           : (raw / fs) / spent if spent else float("inf"),
+                    })
+
+                wall, latency = bench_chain(chunks, make_params(fs, bw, scheme), multiproc)
+                results.append(case | {
+                    "kind"          : "chain",
+                    "stage"         : "multiproc" if multiproc else "in-process",
+                    "seconds"       : wall,
+                    "samples_in"    : chunkSize * count,
+                    "samples_per_s" : chunkSize * count / wall,
+                    "rtf"           : chunkSize * count / fs / wall,
+                    "latency"       : latency,
+                })
+    return results
+
+def format_results(results):
+    lines = [f"{'kind':<6}{'stage':<14}{'dtype':<7}{'signal':<7}{'scheme':<7}{'chunk':>8}{'Msamp/s':>10}{'rtf':>9}"]
+    for r in results:
+        lines.append(f"{r['kind']:<6}{r['stage']:<14}{r['dtype']:<7}{r['signal']:<7}{r['scheme']:<7}{r['chunk_size']:>8}"
+                     f"{r['samples_per_s'] / 1e6:>10.2f}{r['rtf']:>9.1f}")
+    return "\n".join(lines)
+
+def main(argv = None):
+    ap = argparse.ArgumentParser(description="Benchmark the decoding pipeline on synthetic IQ")
+    ap.add_argument("--fs",        type=float, default=0.25e6,         help="SDR sample rate (sdr_fs)")
+    ap.add_argument("--bw",        type=float, default=10e3,           help="Channel bandwidth (sdr_dig_bw)")
+    ap.add_argument("--chunks",    type=int,   nargs="+", default=DEFAULT_CHUNKS, help="Chunk sizes (sdr_chunk_sz)")
+    ap.add_argument("--signals",   nargs="+",  default=list(SIGNAL_KINDS), choices=SIGNAL_KINDS)
+    ap.add_argument("--schemes",   nargs="+",  default=[s.name for s in DemodSchemes], choices=[s.name for s in DemodSchemes])
+    ap.add_argument("--dtypes",    nargs="+",  default=["single"], choices=list(POLICIES), help="Dtype policies to compare")
+    ap.add_argument("--seconds",   type=float, default=2.0,            help="Seconds of signal per case")
+    ap.add_argument("--multiproc", action="store_true",                help="Run the chain with main's process placement")
+    ap.add_argument("--out",       default=None,                       help="Write results as JSON here")
+    args = ap.parse_args(argv)
+
+    results = run(args.fs, args.bw, args.chunks, args.signals, args.schemes, args.seconds, args.multiproc, args.dtypes)
+    print(format_results(results))
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump({"system" : system_info(), "args" : vars(args), "results" : results}, f, indent=1)
+        print(f"[Bench] > Wrote {len(results)} results to {args.out}")
+
+if __name__ == "__main__":
+    sys.exit(main())
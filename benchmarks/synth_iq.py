@@ -0,0 +1,72 @@
+"""
+Synthetic IQ to stand in for the dongle when benchmarking (or testing without one).
+"""
+import numpy as np
+
+SIGNAL_KINDS = ("fm", "am", "noise")
+
+class SyntheticIQ():
+    """
+    Endless stream of complex baseband samples at fs. Phase is carried from one
+    chunk to the next so consecutive chunks join up like a real capture.
+
+    kind:     "fm", "am" or "noise" (noise only)
+    offset:   Carrier offset from the tuned frequency in Hz
+    toneHz:   Frequency of the audio tone that's modulated on
+    fmDevHz:  Peak deviation for FM
+    amDepth:  Modulation depth for AM (0..1)
+    snrDb:    Carrier to noise ratio across the whole fs. None = no noise.
+    """
+    def __init__(self, fs, kind = "fm", offset = 0.0, toneHz = 1e3, fmDevHz = 5e3, amDepth = 0.5, snrDb = 30, seed = 0):
+        if kind not in SIGNAL_KINDS:
+            raise ValueError(f"Unknown signal kind {kind}, expected one of {SIGNAL_KINDS}")
+        self.fs      = float(fs)
+        self.kind    = kind
+        self.offset  = offset
+        self.toneHz  = toneHz
+        self.fmDevHz = fmDevHz
+        self.amDepth = amDepth
+        self.snrDb   = snrDb
+        self.__rng   = np.random.default_rng(seed)
+        self.__n     = 0
+
+    def __noise(self, n, power):
+        return (self.__rng.standard_normal(n) + 1j * self.__rng.standard_normal(n)) * np.sqrt(power / 2)
+
+    def chunk(self, n):
+        """
+        Next n samples as complex64
+        """
+        t = (self.__n + np.arange(n)) / self.fs
+        self.__n += n
+
+        if self.kind == "noise":
+            return self.__noise(n, 1.0).astype(np.complex64)
+
+        tone = np.sin(2 * np.pi * self.toneHz * t)
+        if self.kind == "fm":
+            # Integral of the tone, closed form so there's nothing to carry between chunks
+            phase = 2 * np.pi * self.offset * t - self.fmDevHz / self.toneHz * np.cos(2 * np.pi * self.toneHz * t)
+            x = np.exp(1j * phase)
+        else:
+            x = (1 + self.amDepth * tone) * np.exp(2j * np.pi * self.offset * t)
+
+        if self.snrDb is not None:
+            x = x + self.__noise(n, 10 ** (-self.snrDb / 10))
+        return x.astype(np.complex64)
+
+    def chunks(self, chunkSize, count):
+        """
+        Generator of count chunks of chunkSize samples
+        """
+        for _ in range(count):
+            yield self.chunk(chunkSize)
+
+
+def __testing():
+    for kind in SIGNAL_KINDS:
+        x = SyntheticIQ(0.25e6, kind).chunk(2**14)
+        print(f"{kind:>6}: {x.dtype} {x.shape} mean power {np.mean(np.abs(x) ** 2):.3f}")
+
+if __name__ == "__main__":
+    __testing()
@@ -0,0 +1,108 @@
+"""
+Pool of preallocated numpy buffers that get recycled instead of reallocated.
+"""
+from collections import deque
+import sys
+import numpy as np
+
+class BufferPool():
+    """
+    Hands out fixed shape numpy buffers and takes them back once the consumer is
+    done with them. Running dry allocates a fresh buffer, so a slow consumer costs
+    memory rather than stalling whoever is producing.
+
+    deque.append and deque.pop are atomic, so buffers can be acquired on one thread
+    (pipeline) and released on another (audio callback) without a lock.
+
+    With autoReclaim, buffers also come back on their own once nothing else holds
+    a reference to them (or a view of them). That's for buffers that get dropped
+    at different places downstream, where nobody is in a position to release().
+    acquire() must then only be called from one thread.
+
+    With limit, no more than limit buffers are ever handed out at once. acquire()
+    returns None instead of allocating past it, for callers that would rather
+    skip work than grow without bound.
+    """
+    def __init__(self, shape, dtype = np.float32, prealloc = 8, maxFree = 32, autoReclaim = False, limit = None):
+        self.shape   = shape
+        self.dtype   = np.dtype(dtype)
+        self.maxFree = maxFree
+        self.autoReclaim = autoReclaim
+        self.limit   = limit
+        self.__owned = set()
+        self.__free  = deque()
+        self.__lent  = []
+        for _ in range(prealloc):
+            self.__free.append(self.__alloc())
+
+    def __alloc(self):
+        buf = np.empty(self.shape, dtype=self.dtype)
+        self.__owned.add(id(buf))
+        return buf
+
+    def __reclaim(self):
+        lent = []
+        for buf in self.__lent:
+            # References: the list, buf, getrefcount's argument. Anything more is someone downstream.
+            if sys.getrefcount(buf) > 3:
+                lent.append(buf)
+            elif len(self.__free) < self.maxFree:
+                self.__free.append(buf)
+            else:
+                self.__owned.discard(id(buf))
+        self.__lent = lent
+
+    def acquire(self):
+        """
+        Get a buffer. Contents are whatever was last written to it.
+        """
+        if self.autoReclaim and not self.__free:
+            self.__reclaim()
+        try:
+            buf = self.__free.pop()
+        except IndexError:
+            if self.limit is not None and len(self.__owned) >= self.limit:
+                return None
+            buf = self.__alloc()
+        if self.autoReclaim:
+            self.__lent.append(buf)
+        return buf
+
+    def release(self, buf):
+        """
+        Give a buffer (or any view of one) back to the pool. Arrays that didn't come
+        from this pool are ignored, so callers don't need to check. Releasing the
+        same buffer twice before acquiring it again is a bug in the caller.
+        """
+        while id(buf) not in self.__owned and buf.base is not None:
+            buf = buf.base
+        if id(buf) not in self.__owned:
+            return
+        if len(self.__free) < self.maxFree:
+            self.__free.append(buf)
+        else:
+            self.__owned.discard(id(buf))
+
+    def num_free(self):
+        return len(self.__free)
+
+
+def __testing():
+    pool = BufferPool((4,), prealloc=1, maxFree=1)
+    a = pool.acquire()
+    b = pool.acquire() # Pool is dry, should allocate
+    print(f"{pool.num_free() = }")
+    pool.release(a.reshape(-1, 1)) # Views find their way home
+    pool.release(b)                # Over maxFree, dropped
+    pool.release(np.zeros(4))      # Not ours, ignored
+    print(f"{pool.num_free() = } {pool.acquire() is a = }")
+
+    pool = BufferPool((4,), prealloc=2, autoReclaim=True)
+    a, b = pool.acquire(), pool.acquire()
+    idA, view = id(a), b[1:]
+    del a, b
+    c = pool.acquire() # a is unreferenced and comes back, b is still held through view
+    print(f"{pool.num_free() = } {id(c) == idA = }")
+
+if __name__ == "__main__":
+    __testing()
@@ -5,7 +5,11 @@ import numpy as np
 from enum import Enum, auto
 from scipy.signal import butter, lfilter
 import param_types as ptys
-from collections import deque
+from streaming_dsp import FMDiscriminator, AGC, EnvelopeDetector
+
+# Sample rate assumed by the stateful demodulators when no stage has stamped meta["fs"].
+# Matches the sdr_fs default in main.init_params.
+DEFAULT_FS = 0.25e6
 
 
 class DemodSchemes(Enum):
@@ -19,9 +23,11 @@ class DemodulationManager():
     the fly while keeping calling code unaware of the idea that this isn't actually
     a function.
     """
-    def __init__(self):
+    def __init__(self, fmFastAtan = False, fmDeemphTau = 75e-6, amAttack = 0.005, amRelease = 0.3, amDCBlock = True):
         self.__currDecoding = DemodSchemes.AM
-        self.__normBuffer = deque(maxlen=8)
+        self.__fm  = FMDiscriminator(fastAtan=fmFastAtan, deemphTau=fmDeemphTau)
+        self.__env = EnvelopeDetector(dcBlock=amDCBlock)
+        self.__agc = AGC(attack=amAttack, release=amRelease)
         self.AMnormFactor = 1
         # self.amLpNum, self.amLpDenom = butter(5, (20e3 / 2) / (0.5 * 0.25e6), btype='low', analog=False)
         self.__fxs = {
@@ -32,20 +38,33 @@ class DemodulationManager():
     def DECODE_FM(self, sig, **meta):
         """
         According to the internet this approximates differentiating phase...
+        Now streaming, see FMDiscriminator. meta["fs"] (if present) sets the de-emphasis.
         """
-        diff = np.angle(sig[1:] * np.conj(sig[:-1]))
-        return diff / np.pi
+        return self.__fm(sig, meta.get("fs"))
 
     def DECODE_AM(self, sig, **meta):
-        rawDemod = np.abs(sig)
+        fs = meta.get("fs", DEFAULT_FS)
+        rawDemod = self.__env(sig)
         
-        # Normalize
-        self.__normBuffer.append(rawDemod.max())
-        return rawDemod / np.mean(list(self.__normBuffer)) * self.AMnormFactor
+        # Normalize, sample by sample so it doesn't pump
+        self.__agc.target = self.AMnormFactor
+        demod = self.__agc(rawDemod, fs)
+        if self.__env.dcBlock:
+            demod = self.__env.remove_dc(demod, fs)
+        return demod
         # Quiet any high-frequency products of demodulating
         # return lfilter(self.amLpNum, self.amLpDenom, rawDemod)
     
 
+    def reset(self):
+        """
+        Drop anything carried over from previous chunks. Called while squelched so
+        stale state doesn't click when the squelch opens back up.
+        """
+        self.__fm.reset()
+        self.__env.reset()
+        self.__agc.reset()
+
     def set_demod_scheme(self, key):
         if key not in self.__fxs:
             print(f"Invalid Decoding Scheme {key}. Please use any of {self.__fxs.keys()}")
@@ -67,8 +86,35 @@ class DemodulationManager():
     def create_filter(self, bw, fs):
         """
         Squirreled this function away here since its tangentially related to demodulating the input
-        rf.
+        rf. Returns second-order sections since a single high order (b, a) pair is numerically touchy
+        and would need two params that can't be swapped atomically.
         """
         print(f"Making new filter for {bw = } and {fs = }")
-        num, denom = butter(5, (bw / 2) / (0.5 * fs), btype='low', analog=False)
-        return (num, denom)
+        return butter(5, (bw / 2) / (0.5 * fs), btype='low', analog=False, output='sos')
+
+
+def __testing():
+    """
+    Throughput of the streaming FM discriminator vs the old one shot version
+    """
+    import timeit
+
+    def legacy_fm(sig):
+        return np.angle(sig[1:] * np.conj(sig[:-1])) / np.pi
+
+    for n in (2**11, 2**12, 2**14, 2**16):
+        sig  = np.exp(1j * np.cumsum(np.random.uniform(-0.5, 0.5, n)))
+        reps = max(10, 2**20 // n)
+        fx = {
+            "legacy"      : legacy_fm,
+            "stream"      : FMDiscriminator(),
+            "stream+fast" : FMDiscriminator(fastAtan=True),
+            "stream+deemph" : FMDiscriminator(deemphTau=75e-6),
+        }
+        for name, f in fx.items():
+            args = (sig,) if name != "stream+deemph" else (sig, 41666)
+            t = timeit.timeit(lambda: f(*args), number=reps) / reps
+            print(f"{n:6d} samples | {name:14s} | {t * 1e6:9.1f} us/chunk | {n / t / 1e6:7.2f} MS/s")
+
+if __name__ == "__main__":
+    __testing()
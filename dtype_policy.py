@@ -0,0 +1,67 @@
+"""
+Sample types used by the decoding pipeline.
+
+The DSP blocks in streaming_dsp don't pick a precision of their own, they work in
+whatever precision their input arrives in (coefficients and carried state are
+cast to match). So the precision of the whole chain is set by the few places
+samples enter or leave it, and those are the only places that convert:
+
+- Sources (ProvideRawRF, ReplayRF) hand out policy.complex samples
+- RechunkArray hands the sound card float32, whatever the policy
+
+Everything in between stays in policy.complex / policy.real. The default,
+SINGLE, halves memory traffic compared to numpy's float64 defaults, which is
+what bounds most of these kernels on a Pi.
+"""
+import numpy as np
+
+class DtypePolicy():
+    """
+    A complex sample type and its matching real type
+    """
+    def __init__(self, name, complexType):
+        self.name    = name
+        self.complex = np.dtype(complexType)
+        self.real    = np.finfo(self.complex).dtype
+
+    def to_complex(self, x):
+        """
+        x as policy.complex, without a copy if it already is
+        """
+        return np.asarray(x).astype(self.complex, copy=False)
+
+    def to_real(self, x):
+        """
+        x as policy.real, without a copy if it already is
+        """
+        return np.asarray(x).astype(self.real, copy=False)
+
+    def __repr__(self):
+        return f"<DtypePolicy {self.name}: {self.complex} / {self.real}>"
+
+SINGLE   = DtypePolicy("single", np.complex64)
+DOUBLE   = DtypePolicy("double", np.complex128)
+POLICIES = {p.name : p for p in (SINGLE, DOUBLE)}
+
+_ACTIVE = SINGLE
+
+def get_policy():
+    return _ACTIVE
+
+def set_policy(policy):
+    """
+    Choose the policy (or its name) for stages built from now on. Stages read it
+    when they're constructed, so set it before building the pipeline.
+    """
+    global _ACTIVE
+    _ACTIVE = POLICIES[policy] if isinstance(policy, str) else policy
+
+
+def __testing():
+    x = np.arange(4) * (1 + 1j)
+    for p in POLICIES.values():
+        y = p.to_complex(x)
+        print(p, y.dtype, p.to_real(x.real).dtype, f"no copy when already converted: {p.to_complex(y) is y}")
+
+if __name__ == "__main__":
+    __testing()
@@ -133,6 +133,23 @@ class HWMenuManager():
             "demod_name"        : params["sdr_decoder"].get_demod_scheme_name(),
         }
 
+        # Params shown on screen, and the latestMeta field each one goes in. Changes are pushed to the
+        # screen from a subscription so a held button redraws once per batch, not once per event.
+        self.__shownParams = {
+            "sdr_cf"      : "cf",
+            "sdr_dig_bw"  : "bw",
+            "sdr_squelch" : "squelch",
+            "spkr_volume" : "vol",
+            "sdr_decoder" : "demod_name",
+        }
+        params.subscribe(self.__shownParams.keys(), self.__show_params)
+
+    def __show_params(self, snap, changed):
+        for name in changed:
+            val = snap[name]
+            self.__latestMeta[self.__shownParams[name]] = val.get_demod_scheme_name() if name == "sdr_decoder" else val
+        self.__screenDrawInbox.put(self.__latestMeta)
+
     
     def register_btns(self, pairs):
         """
@@ -183,14 +200,14 @@ class HWMenuManager():
     def handle_freq_tune(self, evt):
         if evt == hw_enums.BtnEvents.UP:
             self.__params["sdr_cf"].step(ptys.NumericParam.StepDir.UP) 
-            self.__params["sdr"].set_center_freq(self.__params["sdr_cf"].get())
-            self.__latestMeta["cf"] = self.__params["sdr_cf"].get()
+            self.__params["sdr_retuner"].request(self.__params["sdr_cf"].get()) # Returns right away, see retune
             print(f"New cf {self.__params['sdr_cf'].get()}")
+            return # Screen hears about it from __show_params
         elif evt == hw_enums.BtnEvents.DOWN:
             self.__params["sdr_cf"].step(ptys.NumericParam.StepDir.DOWN) 
-            self.__params["sdr"].set_center_freq(self.__params["sdr_cf"].get())
-            self.__latestMeta["cf"] = self.__params["sdr_cf"].get()
+            self.__params["sdr_retuner"].request(self.__params["sdr_cf"].get())
             print(f"New cf {self.__params['sdr_cf'].get()}")
+            return
         elif evt == hw_enums.BtnEvents.LEFT:
             self.__latestMeta["FTUNE_cursorPos"] = (self.__latestMeta["FTUNE_cursorPos"] - 1) % 8
             self.__params["sdr_cf"].cycle_step_size(ptys.NumericParam.StepDir.UP)
@@ -206,10 +223,10 @@ class HWMenuManager():
     def handle_squelch(self, evt):
         if evt == hw_enums.BtnEvents.UP:
             self.__params["sdr_squelch"].step(ptys.NumericParam.StepDir.UP)
-            self.__latestMeta["squelch"] = self.__params["sdr_squelch"].get()
+            return
         elif evt == hw_enums.BtnEvents.DOWN:
             self.__params["sdr_squelch"].step(ptys.NumericParam.StepDir.DOWN)
-            self.__latestMeta["squelch"] = self.__params["sdr_squelch"].get()
+            return
         elif evt == hw_enums.BtnEvents.RIGHT:
             self.__params["sdr_squelch"].cycle_step_size(ptys.NumericParam.StepDir.UP)
             self.__latestMeta["SQUELCH_cursorPos"] = (self.__latestMeta["SQUELCH_cursorPos"] + 1) % 4
@@ -223,20 +240,13 @@ class HWMenuManager():
         self.__screenDrawInbox.put(self.__latestMeta)
 
     def handle_bw(self, evt):
+        # The filter is redesigned by a subscription to sdr_dig_bw, see main.init_params
         if evt == hw_enums.BtnEvents.UP:
             self.__params["sdr_dig_bw"].step(ptys.NumericParam.StepDir.UP)
-            self.__latestMeta["bw"] = self.__params["sdr_dig_bw"].get()
-            # Update filter params to new BW
-            n,d = self.__params["sdr_decoder"].create_filter(self.__latestMeta["bw"], self.__params["sdr_fs"])
-            self.__params["sdr_lp_num"].set(n)
-            self.__params["sdr_lp_denom"].set(d)
+            return
         elif evt == hw_enums.BtnEvents.DOWN:
             self.__params["sdr_dig_bw"].step(ptys.NumericParam.StepDir.DOWN)
-            self.__latestMeta["bw"] = self.__params["sdr_dig_bw"].get()
-            # Update filter params to new BW
-            n,d = self.__params["sdr_decoder"].create_filter(self.__latestMeta["bw"], self.__params["sdr_fs"])
-            self.__params["sdr_lp_num"].set(n)
-            self.__params["sdr_lp_denom"].set(d)
+            return
         elif evt == hw_enums.BtnEvents.RIGHT:
             self.__params["sdr_dig_bw"].cycle_step_size(ptys.NumericParam.StepDir.UP)
             self.__latestMeta["BW_cursorPos"] = (self.__latestMeta["BW_cursorPos"] + 1) % 5
@@ -252,10 +262,10 @@ class HWMenuManager():
     def handle_vol(self, evt):
         if evt == hw_enums.BtnEvents.UP:
             self.__params["spkr_volume"].step(ptys.NumericParam.StepDir.UP)
-            self.__latestMeta["vol"] = self.__params["spkr_volume"].get()
+            return
         elif evt == hw_enums.BtnEvents.DOWN:
             self.__params["spkr_volume"].step(ptys.NumericParam.StepDir.DOWN)
-            self.__latestMeta["vol"] = self.__params["spkr_volume"].get()
+            return
         elif evt == hw_enums.BtnEvents.RIGHT:
             self.__params["spkr_volume"].cycle_step_size(ptys.NumericParam.StepDir.UP)
             self.__latestMeta["VOL_cursorPos"] = (self.__latestMeta["VOL_cursorPos"] + 1) % 2
@@ -275,10 +285,12 @@ class HWMenuManager():
             pass
         elif evt == hw_enums.BtnEvents.RIGHT:
             self.__params["sdr_decoder"].cycle_decoding_scheme(step=1) 
-            self.__latestMeta["demod_name"] = self.__params["sdr_decoder"].get_demod_scheme_name() 
+            self.__params["sdr_decoder"].touch() # Changed in place, let the pipeline and screen know
+            return
         elif evt == hw_enums.BtnEvents.LEFT:
             self.__params["sdr_decoder"].cycle_decoding_scheme(step=-1) 
-            self.__latestMeta["demod_name"] = self.__params["sdr_decoder"].get_demod_scheme_name() 
+            self.__params["sdr_decoder"].touch()
+            return
         elif evt == hw_enums.BtnEvents.M1:
             self.__currScreen = Screens.SETTINGS
             self.__latestMeta["screen"] = Screens.SETTINGS
@@ -0,0 +1,126 @@
+"""
+Reading raw IQ capture files.
+
+Supported formats
+-----------------
+- cu8  : Interleaved unsigned 8 bit I/Q, straight from rtl_sdr
+- cf32 : complex64 (GNU Radio's .cfile / .cf32), also what DEBUG_SAVE_TO_FILE
+         writes (.iq)
+- cf64 : complex128, what pyrtlsdr hands out
+"""
+import os
+import numpy as np
+
+IQ_FORMATS = {
+    "cu8"  : np.uint8,
+    "cf32" : np.complex64,
+    "cf64" : np.complex128,
+}
+
+# Extension -> format, for when the format isn't given
+_EXTENSIONS = {
+    ".cu8"   : "cu8",
+    ".bin"   : "cu8",
+    ".cf32"  : "cf32",
+    ".cfile" : "cf32",
+    ".cf64"  : "cf64",
+    ".iq"    : "cf32",
+}
+
+def guess_format(path):
+    ext = os.path.splitext(path)[1].lower()
+    if ext not in _EXTENSIONS:
+        raise ValueError(f"Can't tell the IQ format of {path}, give one of {tuple(IQ_FORMATS)}")
+    return _EXTENSIONS[ext]
+
+def open_iq_file(path, fmt = None):
+    """
+    Memory map an IQ file read only. Returns (format, array). For cu8 the array
+    holds the raw interleaved bytes (an even number of them), otherwise it's the
+    complex samples themselves.
+    """
+    fmt = fmt or guess_format(path)
+    if fmt not in IQ_FORMATS:
+        raise ValueError(f"Unknown IQ format {fmt}, expected one of {tuple(IQ_FORMATS)}")
+    mm = np.memmap(path, dtype=IQ_FORMATS[fmt], mode="r").view(np.ndarray) # Plain array, still backed by the file
+    if fmt == "cu8":
+        mm = mm[:len(mm) & ~1]
+    return fmt, mm
+
+def num_samples(fmt, arr):
+    return len(arr) // 2 if fmt == "cu8" else len(arr)
+
+def _make_cu8_lut():
+    # Every (I, Q) byte pair read as one little endian uint16 -> its complex64 sample
+    idx = np.arange(65536)
+    lut = np.empty(65536, dtype=np.complex64)
+    lut.real = ((idx & 0xff) - 127.5) / 127.5
+    lut.imag = ((idx >> 8)   - 127.5) / 127.5
+    return lut
+_CU8_LUT = _make_cu8_lut()
+_LUT_FASTER = None
+
+def cu8_lut_is_faster():
+    """
+    Whether the table lookup beats the arithmetic on this CPU. Timed once, the
+    first time it's asked, on a chunk the size the dongle hands out.
+    """
+    global _LUT_FASTER
+    if _LUT_FASTER is None:
+        import timeit
+        raw = np.random.default_rng(0).integers(0, 256, 2**17, dtype=np.uint8)
+        out = np.empty(2**16, dtype=np.complex64)
+        lut, arith = (min(timeit.repeat(lambda : cu8_to_complex(raw, out, useLut), number=4, repeat=3)) for useLut in (True, False))
+        _LUT_FASTER = lut < arith
+    return _LUT_FASTER
+
+def cu8_to_complex(raw, out = None, lut = None):
+    """
+    Interleaved uint8 I/Q -> complex64 in [-1, 1], written into out if given.
+    lut does one table lookup per sample, otherwise it's a subtract and scale in
+    float32. Which is quicker depends on the CPU (see __testing), both are far
+    cheaper than going through complex128. By default whichever is quicker here
+    is used (see cu8_lut_is_faster).
+    """
+    if out is None:
+        out = np.empty(len(raw) // 2, dtype=np.complex64)
+    if lut is None:
+        lut = cu8_lut_is_faster()
+    if lut:
+        np.take(_CU8_LUT, np.ascontiguousarray(raw).view("<u2"), out=out)
+        return out
+    iq = out.view(np.float32)
+    np.subtract(raw, 127.5, out=iq, dtype=np.float32)
+    iq *= 1 / 127.5
+    return out
+
+
+def __testing():
+    import tempfile
+    x = (np.exp(2j * np.pi * 0.01 * np.arange(1000)) * 0.9).astype(np.complex64)
+    raw = np.empty(2000, dtype=np.uint8)
+    raw[0::2] = np.round(x.real * 127.5 + 127.5)
+    raw[1::2] = np.round(x.imag * 127.5 + 127.5)
+
+    with tempfile.TemporaryDirectory() as d:
+        for fmt, data in [("cu8", raw), ("cf32", x), ("cf64", x.astype(np.complex128))]:
+            path = os.path.join(d, f"test.{fmt}")
+            data.tofile(path)
+            fmt, mm = open_iq_file(path)
+            y = cu8_to_complex(mm) if fmt == "cu8" else mm
+            print(f"{fmt:>5}: {num_samples(fmt, mm)} samples, max error {np.max(np.abs(y - x)):.4f}")
+
+    # Conversion speed, vs what pyrtlsdr does for format='samples'
+    import timeit
+    raw = np.random.default_rng(0).integers(0, 256, 2**19, dtype=np.uint8)
+    out = np.empty(2**18, dtype=np.complex64)
+    def pyrtlsdr():
+        iq = raw.astype(np.float64).view(np.complex128)
+        iq /= 127.5
+        iq -= (1 + 1j)
+    for name, fx in [("pyrtlsdr", pyrtlsdr), ("lut", lambda : cu8_to_complex(raw, out, lut=True)), ("arith", lambda : cu8_to_complex(raw, out, lut=False))]:
+        print(f"{name:>8}: {timeit.timeit(fx, number=50) / 50 * 1e3:.3f} ms per 2^18 samples")
+    print(f"Defaulting to {'lut' if cu8_lut_is_faster() else 'arith'}")
+
+if __name__ == "__main__":
+    __testing()
@@ -1,11 +1,14 @@
 import asyncio
 import threading
 import time
-from rtlsdr import RtlSdr
-from queue import Queue
+import argparse
+import numpy as np
 
 import system_params as sps
 from speaker_manager import SpeakerManager
+from buffer_pool import BufferPool
+from audio_ring import AudioRing
+from iq_files import IQ_FORMATS
 import param_types as ptys
 
 
@@ -16,6 +19,9 @@ SHUTDOWN_CALLED = threading.Event()
 STOP_PIPELINE   = asyncio.Event()
 PIPELINE_LOOP   = None
 
+METRICS_INTERVAL = 5                                       # Seconds between pipeline metrics snapshots
+METRICS_PATH     = "/tmp/sdr_scanner_metrics_{label}.json" # One file per pipeline process
+
 def signal_handler(sig, frame):
     print(f"Received signal {sig}, shutting down")
     if SHUTDOWN_CALLED.is_set():
@@ -40,38 +46,85 @@ signal.signal(signal.SIGTERM, signal_handler) # for SIGTERM (supervisor uses thi
 signal.signal(signal.SIGINT,  signal_handler) # for Ctrl+C
 
 
-def main():
+def parse_args(argv = None):
+    ap = argparse.ArgumentParser(description="SDR scanner")
+    ap.add_argument("--replay",     metavar="FILE",       help="Play back an IQ capture instead of using the dongle. Runs without buttons / screen.")
+    ap.add_argument("--replay-fmt", choices=IQ_FORMATS,   help="Format of the replay file (default: guess from its extension)")
+    ap.add_argument("--replay-fs",  type=float,           help="Sample rate the replay file was captured at (default: sdr_fs)")
+    ap.add_argument("--fast",       action="store_true",  help="Replay as fast as the pipeline can go instead of in real time")
+    ap.add_argument("--loop",       action="store_true",  help="Start the replay over when it reaches the end of the file")
+    ap.add_argument("--no-audio",   action="store_true",  help="Don't open the sound card")
+    ap.add_argument("--record",     metavar="PREFIX",     help="Record raw IQ to rotating SigMF files named PREFIX_*")
+    ap.add_argument("--record-all", action="store_true",  help="Record while squelched too, not just while the squelch is open")
+    mode = ap.add_mutually_exclusive_group()
+    mode.add_argument("--channels", nargs="+", type=parse_channel, metavar="FREQ[:PRIO]",
+                      help="Monitor these channels (Hz) all at once from one wideband capture, a higher priority wins when several are active. "
+                           "Recording then records the whole capture.")
+    mode.add_argument("--scan",     nargs="+", type=parse_channel, metavar="FREQ[:PRIO]",
+                      help="Scan through these channels (Hz) one at a time. Channels with a priority above 0 are checked every --priority-interval.")
+    ap.add_argument("--lockout",    nargs="+", type=float, default=[], metavar="FREQ", help="Channels to skip while scanning")
+    ap.add_argument("--dwell",      type=float, default=0.1,  help="Seconds to listen to each channel while scanning")
+    ap.add_argument("--hang",       type=float, default=2.0,  help="Seconds the squelch has to stay closed before scanning resumes")
+    ap.add_argument("--priority-interval", type=float, default=2.0, help="Seconds between checks of the priority channels")
+    ap.add_argument("--settle",     type=float, default=0.02, help="Seconds of samples to throw away after each retune")
+    return ap.parse_args(argv)
+
+def parse_channel(text):
+    """
+    "FREQ" or "FREQ:PRIORITY" -> (frequency in Hz, priority)
+    """
+    freq, _, prio = text.partition(":")
+    return (float(freq), int(prio) if prio else 0)
+
+def main(argv = None):
     """
     Main entrypoint for program
     """
+    args = parse_args(argv)
+
     # initialize stuff
     params = init_params()
-    setup_sdr(params)
-    hwManager = start_gpio_hw(params)
+    if args.replay:
+        # Headless, nothing here needs the dongle or the GPIO / screen libraries
+        if args.replay_fs:
+            params["sdr_fs"].set(args.replay_fs) # Filter gets redesigned by the subscription in init_params
+        hwManager  = None
+        bridgeToHW = None
+        setup_retuner(params, None, args.settle)
+    else:
+        setup_retuner(params, setup_sdr(params), args.settle)
+        hwManager  = start_gpio_hw(params)
+        bridgeToHW = hwManager.get_inbox()
+    if args.channels:
+        params["sdr_channels"].set(args.channels)
 
     # Connect decoding pipeline to speakers
-    bridgeToSpeakers = Queue()
-    bridgeToHW       = hwManager.get_inbox()
-    pipelineThread   = threading.Thread(target=pipeline_worker, args = (bridgeToSpeakers, bridgeToHW, params), daemon=True)
-
     sm = SpeakerManager(blockSize=params["spkr_chunk_sz"], sampRate=params["spkr_fs"])
-    sm.set_source(bridgeToSpeakers)
-    sm.init_stream()
-    sm.start()
+    audioPool        = BufferPool((int(params["spkr_chunk_sz"]),), np.float32)
+    pipelineThread   = threading.Thread(target=pipeline_worker, args = (sm, bridgeToHW, params, audioPool, args), daemon=True)
+
+    sm.set_source(AudioRing(capacity=2**16, minTarget=int(params["spkr_chunk_sz"])))
+    sm.set_buffer_pool(audioPool)
+    params["sdr_retuner"].add_listener(lambda gen : sm.flush()) # Nothing from before a retune should still play after it
+    if not args.no_audio:
+        sm.init_stream()
+        sm.start()
 
     pipelineThread.start() # Will go forever unless error or signal encountered.
 
     # Clean up
     pipelineThread.join()
     print("=======================================Done Pipeline")
-    hwManager.stop()
-    print("=======================================Done HW")
-    sm.stop()
-    print("=======================================Done Speakers")
+    if hwManager is not None:
+        hwManager.stop()
+        print("=======================================Done HW")
+    if sm.isInit:
+        sm.stop()
+        print("=======================================Done Speakers")
 
-from hw_interface import BtnEvents, PRESS_TYPE, HWMenuManager
 import multiprocessing as mp
 def start_gpio_hw(params):
+    from hw_interface import BtnEvents, PRESS_TYPE, HWMenuManager
     btnCfg = [
         #    pin    Event             Press Type
             (22  ,  BtnEvents.M1    , PRESS_TYPE.DOWN) ,
@@ -112,15 +165,21 @@ def init_params():
     params.register_new_param(ptys.NumericParam , "spkr_chunk_sz" ,     2**12 ,    1 ,   None , [1]                               )
     params.register_new_param(ptys.NumericParam , "spkr_fs"       ,     44100 ,    1 ,   None , [1]                               )
     params.register_new_param(ptys.ObjParam     , "start_time"    , time.time(),                                                  )
+    params.register_new_param(ptys.ObjParam     , "sdr_channels"  ,        [] ,                                                   ) # (Hz, priority) to channelize, see Channelize
+
+    sos = params["sdr_decoder"].create_filter(params["sdr_dig_bw"], params["sdr_fs"])
+    params.register_new_param(ptys.ObjParam, "sdr_lp_sos", sos)
 
-    num, denom = params["sdr_decoder"].create_filter(params["sdr_dig_bw"], params["sdr_fs"])
-    params.register_new_param(ptys.ObjParam, "sdr_lp_num", num)
-    params.register_new_param(ptys.ObjParam, "sdr_lp_denom", denom)
+    # Redesign the channel filter once per change to what it depends on (not per button press)
+    def redesign_filter(snap, changed):
+        params["sdr_lp_sos"].set(params["sdr_decoder"].create_filter(snap["sdr_dig_bw"], snap["sdr_fs"]))
+    params.subscribe(["sdr_dig_bw", "sdr_fs"], redesign_filter)
 
 
     return params
 
 def setup_sdr(params):
+    from rtlsdr import RtlSdr
     sdr = RtlSdr()
 
     # Configure SDR
@@ -133,11 +192,40 @@ def setup_sdr(params):
     params.register_new_param(ptys.ObjParam, "sdr", sdr)
     return sdr
 
-def pipeline_worker(toSpeakers, toHW, params):
+def setup_retuner(params, sdr, settle = 0.02):
+    """
+    Every retune of the dongle goes through one RetuneScheduler (see retune). Without
+    a dongle (replaying) retunes within the file's band are done digitally, others
+    only bump the generation.
+    """
+    from retune import RetuneScheduler
+    tune = (lambda freq : params["sdr"].set_center_freq(freq)) if sdr is not None else (lambda freq : None)
+    # Anything whose channel stays within the middle 80% of the capture is tuned to digitally (see FineTune)
+    maxOffset = lambda : 0.4 * params["sdr_fs"].get() - params["sdr_dig_bw"].get() / 2
+    retuner = RetuneScheduler(tune, settle=settle, hwFreq=params["sdr_cf"].get(), maxOffset=maxOffset)
+    params.register_new_param(ptys.ObjParam, "sdr_retuner", retuner)
+    return retuner
+
+def make_scanner(params, args):
+    """
+    Scanner over args.scan, retuning through the retuner
+    """
+    from scanner import Scanner
+    retuner = params["sdr_retuner"].get()
+    def tune(freq):
+        params["sdr_cf"].set(freq)
+        retuner.request(freq) # Returns right away, StampTuning tells the scanner when it's done
+    return Scanner([f for f, _ in args.scan], tune,
+                   priority         = [f for f, prio in args.scan if prio > 0],
+                   lockouts         = args.lockout,
+                   dwell            = args.dwell,
+                   hang             = args.hang,
+                   priorityInterval = args.priority_interval)
+
+def pipeline_worker(toSpeakers, toHW, params, audioPool, args):
     # Create loop for this thread
-    from pc_model import AsyncHandler, Graph as PCgraph
-    from system_pipeline_stages import ProvideRawRF, Filter, Downsample, RechunkArray, ReshapeArray, Endpoint, DemodulateRF, CalcDecibels, ApplySquelch, AdjustVolume, Endpoint, DEBUG_SAVE_TO_FILE
-    from pc_model               import FxApplyWindow
+    from pc_model import ProcessHandler, Graph as PCgraph
+    from system_pipeline_stages import ProvideRawRF, ReplayRF, Record, build_chain
     global PIPELINE_LOOP
     global PIPELINE_UP
     global STOP_PIPELINE
@@ -147,26 +235,41 @@ def pipeline_worker(toSpeakers, toHW, params):
     
     # Set up and launch decoding / playback pipeline
     m = PCgraph()
-    m.add_linear_chain([ProvideRawRF(params["sdr"], params["sdr_chunk_sz"], STOP_PIPELINE),
-                        CalcDecibels(),
-                        ApplySquelch(params["sdr_squelch"]),
-                        # DEBUG_SAVE_TO_FILE(f"./logs/pre_filt_{time.strftime('%d-%H-%M-%S')}.iq"),
-                        Filter(params["sdr_lp_num"], params["sdr_lp_denom"]),
-                        # DEBUG_SAVE_TO_FILE(f"./logs/post_filt_{time.strftime('%d-%H-%M-%S')}.iq"),
-                        DemodulateRF(params["sdr_decoder"]),
-                        Downsample(params["sdr_fs"], params["spkr_fs"]),
-                        RechunkArray(params["spkr_chunk_sz"]),
-                        AdjustVolume(params["spkr_volume"]),
-               
-                        # Data is now audio ready for speakers
-                        ReshapeArray((-1,1)),
-                        FxApplyWindow(lambda d : toSpeakers.put(d.data)),
-                        FxApplyWindow(lambda d : toHW.put(d.meta)),
-                        Endpoint()])
-    
-    pipeline = AsyncHandler(m)
+    if args.replay:
+        source = ReplayRF(args.replay, params["sdr_chunk_sz"].get(), STOP_PIPELINE, params["sdr_fs"].get(),
+                          args.replay_fmt, realtime=not args.fast, loop=args.loop)
+    else:
+        source = ProvideRawRF(params["sdr"], params["sdr_chunk_sz"], STOP_PIPELINE)
+    retuner = params["sdr_retuner"].get()
+    scanner = make_scanner(params, args) if args.scan else None
+    record = None
+    if args.record:
+        record = Record(args.record, params["sdr_fs"], None if args.replay else params["sdr_cf"],
+                        None if args.replay else lambda : params["sdr"].gain)
+    chain = build_chain(source, params, audioPool, toSpeakers, toHW, scanner, record, args.record_all,
+                        # A file replayed as fast as possible has no real time to keep up with, let it wait instead of dropping
+                        dropOldest = not (args.replay and args.fast))
+    m.add_linear_chain([stage for stage, _ in chain], [placement for _, placement in chain])
+
+    # Forked stages get a copy of params, keep it in sync with changes made from this process
+    paramUpdates = mp.get_context("fork").Queue()
+    params.add_mirror(paramUpdates)
+    def child_init(label):
+        threading.Thread(target=params.apply_mirrored, args=(paramUpdates,), daemon=True).start()
+
+    # Each process drops a snapshot of its stages' metrics here every few seconds
+    # Ring slots between processes have to hold a whole chunk off the dongle
+    from dtype_policy import get_policy
+    slotBytes = int(params["sdr_chunk_sz"]) * get_policy().complex.itemsize
+    pipeline = ProcessHandler(m, childInit=child_init, ringSlotBytes=slotBytes,
+                              reportInterval=METRICS_INTERVAL, reportPath=METRICS_PATH)
+    pipeline.add_metrics_source("audio", toSpeakers.get_stats)
+    pipeline.add_metrics_source("retune", retuner.get_stats)
+    if scanner is not None:
+        pipeline.add_metrics_source("scanner", scanner.get_stats)
     PIPELINE_UP.set()
     pipeline.run()
+    paramUpdates.put(None)
 
     PIPELINE_LOOP.close()
 
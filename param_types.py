@@ -1,17 +1,180 @@
 from threading import Lock
+import heapq
+import itertools
+import os
+import threading
+import time
+import weakref
+
+# Every param's monitor gets replaced in forked children. The fork could have
+# happened while another thread held one and the child would deadlock on it.
+_ALL_PARAMS = weakref.WeakValueDictionary() # Keyed by id since NumericParam isn't hashable
+_FORK_AWARE = weakref.WeakSet()             # Anything else with locks / threads to redo in a child (_after_fork())
+def _reset_monitors():
+    for p in list(_ALL_PARAMS.values()):
+        p.monitor = Lock()
+    for obj in list(_FORK_AWARE):
+        obj._after_fork()
+os.register_at_fork(after_in_child=_reset_monitors)
+
+class Notifier():
+    """
+    Runs change notifications (see Subscription) one at a time, each once its
+    delay is up (in the order they were handed over when due together), either
+    on a thread of its own (started on first use) or on an asyncio event loop.
+    Writers never wait on a subscriber.
+    """
+    def __init__(self, loop = None, name = "param_notify"):
+        self.loop     = loop
+        self.name     = name
+        self.__due    = []                # Heap of (when, seq, fx)
+        self.__seq    = itertools.count()
+        self.__cv     = threading.Condition()
+        self.__thread = None
+        _FORK_AWARE.add(self)
+
+    def _after_fork(self):
+        # The thread didn't come along into the child, start another one if it's needed there
+        self.__due    = []
+        self.__cv     = threading.Condition()
+        self.__thread = None
+
+    def submit(self, fx, delay = 0.0):
+        """
+        Run fx() delay seconds from now
+        """
+        if self.loop is not None:
+            if delay > 0:
+                self.loop.call_soon_threadsafe(self.loop.call_later, delay, fx)
+            else:
+                self.loop.call_soon_threadsafe(fx)
+            return
+        with self.__cv:
+            if self.__thread is None:
+                self.__thread = threading.Thread(target=self.__worker, name=self.name, daemon=True)
+                self.__thread.start()
+            heapq.heappush(self.__due, (time.monotonic() + delay, next(self.__seq), fx))
+            self.__cv.notify()
+
+    def __worker(self):
+        while True:
+            with self.__cv:
+                while (wait := self.__due[0][0] - time.monotonic() if self.__due else None) is None or wait > 0:
+                    self.__cv.wait(wait)
+                _, _, fx = heapq.heappop(self.__due)
+            try:
+                fx()
+            except Exception as e:
+                print(f"[Params] > Change subscriber {fx} failed: {e!r}")
+
+_DEFAULT_NOTIFIER = Notifier()
+
+def default_notifier():
+    return _DEFAULT_NOTIFIER
+
+class Subscription():
+    """
+    One subscriber's link to whatever it watches. fx is called at most once
+    every interval seconds: a change after a quiet spell is delivered right away,
+    changes that come in sooner than that wait for the interval to be up and are
+    delivered together, as one call with the keys of everything that changed.
+    So a held button (a step every 100 ms or so) makes one call per interval
+    and not one per step. Values should be read when the call comes, they're
+    the newest ones by then.
+    """
+    def __init__(self, fx, notifier = None, interval = 0.25):
+        self.fx       = fx
+        self.notifier = notifier if notifier is not None else _DEFAULT_NOTIFIER
+        self.interval = interval
+        self.active   = True
+        self.__lock   = Lock()
+        self.__keys   = []
+        self.__last   = -float("inf") # When the last delivery went out (time.monotonic())
+        _FORK_AWARE.add(self)
+
+    def _after_fork(self):
+        # A delivery waiting on the parent's notifier never happens here
+        self.__lock = Lock()
+        self.__keys = []
+
+    def notify(self, key):
+        if not self.active:
+            return
+        with self.__lock:
+            first = not self.__keys
+            if key not in self.__keys:
+                self.__keys.append(key)
+            delay = max(0.0, self.__last + self.interval - time.monotonic())
+        if first:
+            self.notifier.submit(self.__deliver, delay)
+
+    def __deliver(self):
+        with self.__lock:
+            keys, self.__keys = self.__keys, []
+            self.__last = time.monotonic()
+        if self.active and keys:
+            self.fx(keys)
+
+    def cancel(self):
+        self.active = False
 
 class BaseParam():
     """
-    Adds a monitor that will be used when set and get are called
+    Adds a monitor that will be used when set is called. get doesn't lock, it just
+    hands back whatever value was set last.
+
+    version goes up on every change so readers on hot paths can keep whatever
+    they derive from the value and only redo it when version moves on, e.g.
+
+        if self.bw.version != self.__bwVersion: ...
     """
     def __init__(self, startVal):
         self.currVal = startVal
+        self.version = 0
         self.monitor = Lock()
+        self.setHooks = []    # Called with the new value after every set
+        self.changeHooks = [] # Called with this param after every set or touch
+        _ALL_PARAMS[id(self)] = self
     def set(self, val):
         with self.monitor:
-            self.currVal = val
+            self._assign(val)
+            self.version += 1
+        for hook in self.setHooks:
+            hook(val)
+        for hook in self.changeHooks:
+            hook(self)
+    def _assign(self, val):
+        """
+        Store val. Runs under the monitor before the new version is published, so
+        subclasses that cache anything derived from the value drop it here.
+        """
+        self.currVal = val
+    def touch(self):
+        """
+        The value was changed in place (not through set). Bumps the version so
+        readers notice. Not forwarded to setHooks since the value is the same object.
+        """
+        with self.monitor:
+            self.version += 1
+        for hook in self.changeHooks:
+            hook(self)
     def get(self):
         return self.currVal
+    def get_versioned(self):
+        """
+        (value, version) read together, so the version is the one that value was set with
+        """
+        with self.monitor:
+            return self.currVal, self.version
+    def subscribe(self, fx, notifier = None, interval = 0.25):
+        """
+        Call fx(param) on notifier (a shared thread by default) after this param
+        changes, at most once every interval seconds (see Subscription). Returns
+        the Subscription.
+        """
+        sub = Subscription(lambda keys : fx(self), notifier, interval)
+        self.changeHooks.append(lambda param : sub.notify(None))
+        return sub
     
 from enum import IntEnum
 class NumericParam(BaseParam):
@@ -43,11 +206,9 @@ class NumericParam(BaseParam):
             super().set(val)
 
     def __int__(self):
-        with self.monitor:
-            return int(self.currVal)
+        return int(self.currVal)
     def __float__(self):
-        with self.monitor:
-            return float(self.currVal)
+        return float(self.currVal)
     def __repr__(self):
         return f"NumericParam({self.get()})"
     def __index__(self):
@@ -102,24 +263,44 @@ class EnumParam(BaseParam):
         return not (self.get() == other)
 
 class ObjParam(FuncParam):
+    """
+    Methods of the object called through the param run under its monitor. If
+    they change the object, call touch() afterwards so readers pick it up.
+    """
+    def __init__(self, startVal):
+        super().__init__(startVal)
+        self.__wrapped = {} # name -> locked wrapper around currVal's method, until the next set
+
+    def _assign(self, val):
+        super()._assign(val)
+        self.__wrapped = {}
+
     def __getattr__(self, name):
         """
         Forward any attribute access thats not in this class (get,set,etc)
         Note this means that we can't properly encapsulate objects that have those
         methods.
         """
-        attr = getattr(self.currVal, name)
+        if name.startswith("_ObjParam__"):
+            raise AttributeError(name) # Not set up yet (unpickling)
+        wrapped = self.__wrapped.get(name)
+        if wrapped is not None:
+            return wrapped
+
+        # Under the monitor so a set() can't swap the object out between looking
+        # the attribute up and caching a wrapper around it
+        with self.monitor:
+            attr = getattr(self.currVal, name)
+            if not callable(attr):
+                # Attribute access (e.g., shape, dtype)
+                return attr
 
-        if callable(attr):
-            # If it's a method, wrap it to acquire the lock
+            # If it's a method, wrap it to acquire the lock. Kept so repeat calls don't make a new one each time.
             def locked_method(*args, **kwargs):
                 with self.monitor:
                     return attr(*args, **kwargs)
+            self.__wrapped[name] = locked_method
             return locked_method
-        else:
-            # Attribute access (e.g., shape, dtype)
-            with self.monitor:
-                return attr
 
 
 
@@ -166,8 +347,24 @@ def __testing():
 
     print(p.get())
     print(p.min())
+    # Hooks run after set, they should already be calling into the new object
+    p.changeHooks.append(lambda param : print(f"Hook sees min {param.min()}"))
     p.set(np.array([1,2,3,4,5]))
     print(p.min())
+    print(f"Version after one set: {p.version}, same wrapper on repeat access: {p.min is p.min}")
+
+    print("========================================")
+
+    # A held button cascades a step every 100 ms or so, that should take a notification per interval
+    p = NumericParam(0, 0, 100, [1])
+    calls = []
+    p.subscribe(lambda param : calls.append((time.monotonic(), param.get())), interval=0.25)
+    for _ in range(10):
+        p.step(NumericParam.StepDir.UP)
+        time.sleep(0.1)
+    time.sleep(0.3)
+    gaps = [round(b[0] - a[0], 2) for a, b in zip(calls, calls[1:])]
+    print(f"10 steps 100 ms apart -> {len(calls)} notifications {gaps} s apart, last saw {calls[-1][1]}")
 
 
 if __name__ == "__main__":
@@ -1,3 +1,5 @@
 from pc_model.pc_graph  import BaseNode, Graph
 from pc_model.pc_runner import AsyncHandler
-from pc_model.pc_stages import BaseConsumer, BaseProducer, FxApplyWindow, FxApplyWorker, AbstractWindow, AbstractWorker
\ No newline at end of file
+from pc_model.pc_stages import BaseConsumer, BaseProducer, FxApplyWindow, FxApplyWorker, AbstractWindow, AbstractWorker, ExecPolicy, DropPolicy, EdgeQueue
+from pc_model.pc_metrics import StageMetrics, LatencyHistogram
+from pc_model.pc_multiproc import ProcessHandler, SharedSampleRing, RingSink, RingSource
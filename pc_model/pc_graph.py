@@ -15,11 +15,12 @@ def _GET_UID():
 
 
 class BaseNode():
-    def __init__(self, data = None, parents = None, children = None):
+    def __init__(self, data = None, parents = None, children = None, placement = None):
         self.data      = data
         self._parents  = parents  if parents  is not None else []
         self._children = children if children is not None else []
         self._id = _GET_UID()
+        self.placement = placement # Which process runs this node (None = the one that calls run). See pc_multiproc
 
     def get_id(self):
         return self._id
@@ -57,7 +58,7 @@ class BaseNode():
             return False
         
     def __deepcopy__(self, memo):
-        return type(self)(data=self.data, parents=self._parents.copy(), children=self._children.copy())
+        return type(self)(data=self.data, parents=self._parents.copy(), children=self._children.copy(), placement=self.placement)
 
     def __str__(self):
         return f"<{type(self).__name__}: data({type(self.data).__name__})={self.data} children={tuple(self._children)} parents={tuple(self._parents)}>"
@@ -70,11 +71,11 @@ class Graph():
     def __init__(self):
         self._nodes : list[BaseNode] = []
     
-    def add_node(self, data):
+    def add_node(self, data, placement = None):
         if type(data) is BaseNode:
             self._nodes.append(data)
         else:
-            self._nodes.append(BaseNode(data=data))
+            self._nodes.append(BaseNode(data=data, placement=placement))
         return self._nodes[-1]
     
     def add_edge(self, n1: BaseNode, n2: BaseNode):
@@ -106,13 +107,18 @@ class Graph():
         for _ in range(copies):
             self._nodes.append(copy.deepcopy(n))
 
-    def add_linear_chain(self, objs):
+    def add_linear_chain(self, objs, placements = None):
         """
         Creates a linked list of nodes with each node containing an element from objs.
         Nodes are linked together in order they appear in objs with objs[0] not
-        having a parent, and objs[-1] not having a child
+        having a parent, and objs[-1] not having a child.
+        placements, if given, is the placement label for each element of objs.
         """
-        nodes = [self.add_node(obj) for obj in objs]
+        if placements is None:
+            placements = [None] * len(objs)
+        if len(placements) != len(objs):
+            raise ValueError(f"Got {len(placements)} placements for {len(objs)} nodes")
+        nodes = [self.add_node(obj, placement) for obj, placement in zip(objs, placements)]
         lastNode, *rest = nodes            
         for n in rest:
             self.add_edge(lastNode, n)
@@ -0,0 +1,201 @@
+"""
+Lightweight per-stage instrumentation for producer-consumer graphs.
+
+Every stage owns a StageMetrics. The base classes in pc_stages feed it as
+packets flow, so nothing needs to be done in individual stages. Recording a
+packet is a couple of perf_counter_ns() calls and some integer adds, which is
+cheap enough to leave on all the time.
+
+Everything is recorded from the event loop thread of the process running the
+stage. Reading a snapshot from some other thread only ever sees slightly
+stale counters.
+
+What is recorded per stage
+--------------------------
+- packetsIn / samplesIn    : What the stage pulled from its source
+- packetsOut / samplesOut  : What the stage put in its outbox
+- work                     : Histogram of time spent in process() / inspect()
+- blocked                  : Time spent waiting for room in the outbox (backpressure)
+- queue depth              : Outbox depth seen on each put, current depth and drops
+- latency                  : Histogram of packet age when it leaves the stage
+
+Samples are counted with len(packet). Packets without a length count as 0.
+Packet age is measured from packet.captureTime (a time.perf_counter() value),
+packets without one are not counted. perf_counter is system wide on Linux so
+ages stay comparable across forked processes.
+"""
+import json
+import os
+import time
+
+class LatencyHistogram():
+    """
+    Histogram of durations with power of two buckets (in ns). Bucket i holds
+    durations in [2^(i-1), 2^i). Percentiles are reported as the top of the bucket
+    they fall in, so they are at most 2x pessimistic.
+    """
+    NUM_BUCKETS = 48 # 2^47 ns is more than a day
+
+    def __init__(self):
+        self.counts = [0] * self.NUM_BUCKETS
+        self.total  = 0
+        self.sumNs  = 0
+        self.maxNs  = 0
+
+    def record(self, ns):
+        self.counts[min(ns.bit_length(), self.NUM_BUCKETS - 1)] += 1
+        self.total += 1
+        self.sumNs += ns
+        if ns > self.maxNs:
+            self.maxNs = ns
+
+    def percentile(self, p):
+        """
+        Upper bound in ns of the p-th percentile (0 <= p <= 100)
+        """
+        if not self.total:
+            return 0
+        want = p / 100 * self.total
+        seen = 0
+        for i, n in enumerate(self.counts):
+            seen += n
+            if seen >= want and n:
+                return min(1 << i, self.maxNs)
+        return self.maxNs
+
+    def summary(self):
+        """
+        Count, mean, p50/p90/p99 and max in microseconds
+        """
+        return {
+            "count"   : self.total,
+            "mean_us" : self.sumNs / self.total / 1e3 if self.total else 0.0,
+            "p50_us"  : self.percentile(50) / 1e3,
+            "p90_us"  : self.percentile(90) / 1e3,
+            "p99_us"  : self.percentile(99) / 1e3,
+            "max_us"  : self.maxNs / 1e3,
+        }
+
+def _num_samples(pkt):
+    try:
+        return len(pkt)
+    except TypeError:
+        return 0
+
+class StageMetrics():
+    """
+    Counters for one stage
+    """
+    def __init__(self, name):
+        self.name       = name
+        self.packetsIn  = 0
+        self.samplesIn  = 0
+        self.packetsOut = 0
+        self.samplesOut = 0
+        self.work       = LatencyHistogram()
+        self.latency    = LatencyHistogram()
+        self.blockedNs  = 0
+        self.depthSum   = 0
+        self.depthMax   = 0
+        self.queue      = None # Outbox, for current depth and drops
+        self.__t0       = None
+
+    def __start(self):
+        if self.__t0 is None:
+            self.__t0 = time.perf_counter()
+
+    def record_in(self, pkt):
+        self.__start()
+        self.packetsIn += 1
+        self.samplesIn += _num_samples(pkt)
+
+    def record_work(self, ns):
+        self.work.record(ns)
+
+    def record_out(self, pkt, depth, blockedNs):
+        self.__start()
+        self.packetsOut += 1
+        self.samplesOut += _num_samples(pkt)
+        t = getattr(pkt, "captureTime", None)
+        if t is not None:
+            self.latency.record(max(0, int((time.perf_counter() - t) * 1e9)))
+        self.blockedNs  += blockedNs
+        self.depthSum   += depth
+        if depth > self.depthMax:
+            self.depthMax = depth
+
+    def snapshot(self):
+        """
+        Plain dict of everything recorded so far. Rates are averaged over the time
+        since the first packet. Diff two snapshots for rates over an interval.
+        """
+        elapsed = time.perf_counter() - self.__t0 if self.__t0 is not None else 0.0
+        rate    = (lambda n : n / elapsed) if elapsed > 0 else (lambda n : 0.0)
+        return {
+            "name"          : self.name,
+            "elapsed_s"     : elapsed,
+            "packets_in"    : self.packetsIn,
+            "packets_out"   : self.packetsOut,
+            "samples_in"    : self.samplesIn,
+            "samples_out"   : self.samplesOut,
+            "packets_per_s" : rate(max(self.packetsIn, self.packetsOut)),
+            "samples_per_s" : rate(max(self.samplesIn, self.samplesOut)),
+            "work"          : self.work.summary(),
+            "latency"       : self.latency.summary(),
+            "busy_frac"     : rate(self.work.sumNs / 1e9),
+            "blocked_frac"  : rate(self.blockedNs / 1e9),
+            "queue_depth"   : self.queue.qsize() if self.queue is not None else 0,
+            "queue_max"     : self.depthMax,
+            "queue_mean"    : self.depthSum / self.packetsOut if self.packetsOut else 0.0,
+            "dropped"       : getattr(self.queue, "numDropped", 0),
+        }
+
+def format_text(stages):
+    """
+    Human readable table of a {stage name : snapshot} dict
+    """
+    lines = [f"{'stage':<28}{'pkt/s':>9}{'samp/s':>12}{'p50 us':>10}{'p99 us':>10}{'busy':>7}{'blkd':>7}{'q':>4}{'qmax':>6}{'drop':>6}{'age50 ms':>10}{'age99 ms':>10}"]
+    for name, s in stages.items():
+        lines.append(f"{name:<28}{s['packets_per_s']:>9.1f}{s['samples_per_s']:>12.0f}"
+                     f"{s['work']['p50_us']:>10.0f}{s['work']['p99_us']:>10.0f}"
+                     f"{s['busy_frac']:>7.1%}{s['blocked_frac']:>7.1%}"
+                     f"{s['queue_depth']:>4}{s['queue_max']:>6}{s['dropped']:>6}"
+                     f"{s['latency']['p50_us'] / 1e3:>10.1f}{s['latency']['p99_us'] / 1e3:>10.1f}")
+    return "\n".join(lines)
+
+def write_snapshot(path, snapshot, fmt = "json"):
+    """
+    Write a snapshot (as returned by AsyncHandler.get_metrics()) to path, or print it
+    if path is None. The file is replaced atomically so scrapers never see half of one.
+    """
+    if fmt == "json":
+        text = json.dumps(snapshot, indent=1)
+    else:
+        text = format_text(snapshot["stages"])
+        for name, extra in snapshot.get("extra", {}).items():
+            text += f"\n{name}: {extra}"
+
+    if path is None:
+        print(f"[PC Metrics] >\n{text}")
+        return
+    tmp = f"{path}.tmp"
+    with open(tmp, "w") as f:
+        f.write(text)
+    os.replace(tmp, path)
+
+
+def __testing():
+    h = LatencyHistogram()
+    for ns in [1000] * 90 + [100000] * 9 + [5000000]:
+        h.record(ns)
+    print(h.summary())
+
+    m = StageMetrics("test")
+    for _ in range(10):
+        m.record_in([0] * 128)
+        m.record_work(2000)
+        m.record_out([0] * 64, 1, 0)
+    print(format_text({"test" : m.snapshot()}))
+
+if __name__ == "__main__":
+    __testing()
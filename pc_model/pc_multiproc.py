@@ -0,0 +1,344 @@
+"""
+Runs a producer-consumer graph across several processes.
+
+Every node in the graph has a placement label (see BaseNode.placement). Nodes
+without one stay in the calling process, every other label gets its own forked
+process running its own event loop. Edges that cross between processes are cut
+and bridged with a RingSink / RingSource pair:
+
+    parent stage -> RingSink ==(SharedSampleRing)==> RingSource -> child stage
+
+Sample arrays travel through a ring of fixed size slots in shared memory. The
+packet itself (with .data stripped off) goes through a multiprocessing queue,
+which is cheap since all that's left to pickle is a small metadata dict. Size
+the slots for the largest packet expected (ProcessHandler's ringSlotBytes),
+anything bigger still gets through but is pickled whole, which is far slower.
+
+Notes
+-----
+- Processes are forked (not spawned) so stages don't need to be picklable. They
+  do get a *copy* of everything in the parent though, so any state shared with
+  other threads (system params, ...) needs to be synced by hand. See childInit.
+"""
+import asyncio
+import copy
+import multiprocessing as mp
+import os
+import signal
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing import shared_memory
+from multiprocessing.connection import wait
+
+import numpy as np
+
+from pc_model.pc_graph  import BaseNode, Graph
+from pc_model.pc_runner import AsyncHandler
+from pc_model.pc_stages import BaseConsumer, BaseProducer
+
+_FORK_CTX = mp.get_context("fork")
+
+# Event loops forked children inherited from the parent, see ProcessHandler.__child_main
+_INHERITED_LOOPS = []
+
+class SharedSampleRing():
+    """
+    Single writer, single reader ring of fixed size slots in shared memory.
+    put() blocks while every slot is in use, which is what provides backpressure
+    between processes. Packets too big for a slot still take one up (for the
+    backpressure) but go through the queue pickled.
+
+    abort() is for when either side has failed. The reader sees the end of the
+    stream and the writer gets a RuntimeError instead of waiting on a slot that
+    will never be freed.
+    """
+    def __init__(self, slotBytes, numSlots):
+        self.slotBytes    = slotBytes
+        self.numSlots     = numSlots
+        self.shm          = shared_memory.SharedMemory(create=True, size=slotBytes * numSlots)
+        self.metaQ        = _FORK_CTX.Queue()
+        self.freeSlots    = _FORK_CTX.Semaphore(numSlots)
+        self.aborted      = _FORK_CTX.Event()
+        self.numOversized = 0 # Packets that had to be pickled
+        self.__wIdx       = 0
+
+    def put(self, pkt):
+        """
+        Send a packet. Anything with an ndarray .data has the samples copied into the
+        ring and only the rest of the packet is pickled. None ends the stream.
+        """
+        if self.aborted.is_set():
+            # The reader may be gone, don't hang this process's exit flushing metaQ to it
+            self.metaQ.cancel_join_thread()
+            if pkt is None:
+                return
+            raise RuntimeError("Ring aborted, the process on the other side of it failed")
+        if pkt is None:
+            self.metaQ.put(None)
+            return
+
+        data = getattr(pkt, "data", None)
+        if not isinstance(data, np.ndarray):
+            self.metaQ.put((None, None, None, pkt))
+            return
+
+        self.freeSlots.acquire()
+        if self.aborted.is_set():
+            self.freeSlots.release() # Pass it on in case anything else is waiting
+            return self.put(pkt)
+        if data.nbytes > self.slotBytes:
+            if not self.numOversized:
+                print(f"[PC Model] > Packet of {data.nbytes} bytes does not fit in {self.slotBytes} byte ring slot, pickling it instead")
+            self.numOversized += 1
+            self.metaQ.put((-1, None, None, pkt))
+            return
+
+        slot = self.__wIdx % self.numSlots
+        self.__wIdx += 1
+        np.ndarray(data.shape, data.dtype, buffer=self.shm.buf, offset=slot * self.slotBytes)[...] = data
+
+        stripped = copy.copy(pkt)
+        stripped.data = None
+        self.metaQ.put((slot, data.dtype.str, data.shape, stripped))
+
+    def get(self):
+        """
+        Receive the next packet (or None at end of stream). Samples are copied out of
+        the ring so the slot can be reused right away.
+        """
+        msg = self.metaQ.get()
+        if msg is None:
+            return None
+
+        slot, dtype, shape, pkt = msg
+        if slot is None:
+            return pkt
+        if slot < 0:
+            self.freeSlots.release() # Oversized, came pickled
+            return pkt
+
+        pkt.data = np.ndarray(shape, np.dtype(dtype), buffer=self.shm.buf, offset=slot * self.slotBytes).copy()
+        self.freeSlots.release()
+        return pkt
+
+    def abort(self):
+        """
+        Wake every reader (end of stream) and writer (free slots) on both sides
+        """
+        if self.aborted.is_set():
+            return
+        self.aborted.set()
+        # Whoever was meant to read metaQ may be gone, don't hang exit flushing it
+        self.metaQ.cancel_join_thread()
+        self.metaQ.put(None)
+        for _ in range(self.numSlots):
+            self.freeSlots.release()
+
+    def close(self, unlink = False):
+        # After an abort a stage's thread could still be copying in or out, leave
+        # the memory mapped until the process exits
+        if not self.aborted.is_set():
+            self.shm.close()
+        if unlink:
+            self.shm.unlink()
+
+class RingSink(BaseConsumer):
+    """
+    Last stage on the sending side of a process boundary
+    """
+    def __init__(self, ring):
+        super().__init__()
+        self.ring = ring
+
+    async def consume(self):
+        loop = asyncio.get_running_loop()
+        ex = ThreadPoolExecutor(max_workers=1, thread_name_prefix="ring_sink")
+        try:
+            while (pkt := await self.pull()) is not None:
+                await loop.run_in_executor(ex, self.ring.put, pkt)
+            await loop.run_in_executor(ex, self.ring.put, None)
+        finally:
+            # If cancelled the thread may be waiting on a slot, SharedSampleRing.abort() frees it
+            ex.shutdown(wait=False)
+
+class RingSource(BaseProducer):
+    """
+    First stage on the receiving side of a process boundary
+    """
+    def __init__(self, ring):
+        super().__init__()
+        self.ring = ring
+
+    async def produce(self):
+        loop = asyncio.get_running_loop()
+        ex = ThreadPoolExecutor(max_workers=1, thread_name_prefix="ring_source")
+        try:
+            while (pkt := await loop.run_in_executor(ex, self.ring.get)) is not None:
+                await self.outbox.put(pkt)
+        finally:
+            # If cancelled the thread may be waiting on a packet, SharedSampleRing.abort() ends it
+            ex.shutdown(wait=False)
+        await self.stop()
+
+class ProcessHandler():
+    """
+    Drop in replacement for AsyncHandler that honors node placement.
+
+    childInit(label) is called first thing in each forked process. Use it to
+    hook up anything the stages in that process need from the parent.
+
+    Metrics reporting works like AsyncHandler's, each process reports on its own
+    stages. reportPath may contain "{label}" which is filled in with the placement
+    label ("main" for the calling process), otherwise processes overwrite each
+    other's snapshots.
+
+    If the calling process's stages fail, every ring is aborted (see
+    SharedSampleRing.abort) and each child gets shutdownTimeout seconds to finish
+    before it's killed. If a child exits with a non zero exit code the rings are
+    aborted too, which ends the other processes' streams, and run() raises.
+    """
+    LOCAL_LABEL = "main"
+
+    def __init__(self, mGraph: Graph = None, childInit = None, ringSlotBytes = 2**19, ringSlots = 8,
+                 reportInterval = None, reportPath = None, reportFmt = "json", shutdownTimeout = 5.0):
+        self.mGraph          = mGraph
+        self.childInit       = childInit
+        self.ringSlotBytes   = ringSlotBytes
+        self.ringSlots       = ringSlots
+        self.reportInterval  = reportInterval
+        self.reportPath      = reportPath
+        self.reportFmt       = reportFmt
+        self.shutdownTimeout = shutdownTimeout
+        self.__rings         = []
+        self.__procs         = []
+        self.__local         = None
+        self.__extra         = {}
+
+    def partition(self):
+        """
+        Split the graph into one subgraph per placement, bridging edges that cross
+        placements with shared memory rings.
+        """
+        subgraphs = {}
+        newNodes  = {}
+        for node in self.mGraph:
+            newNodes[node.get_id()] = subgraphs.setdefault(node.placement, Graph()).add_node(BaseNode(data=node.data))
+
+        for node in self.mGraph:
+            for p in node.get_parents():
+                child, parent = newNodes[node.get_id()], newNodes[p.get_id()]
+                if p.placement == node.placement:
+                    subgraphs[node.placement].add_edge(parent, child)
+                    continue
+                ring = SharedSampleRing(self.ringSlotBytes, self.ringSlots)
+                self.__rings.append(ring)
+                subgraphs[p.placement].add_edge(parent, BaseNode(data=RingSink(ring)))
+                subgraphs[node.placement].add_edge(BaseNode(data=RingSource(ring)), child)
+                print(f"[PC Model] > Bridging {type(p.data).__name__} ({p.placement}) -> {type(node.data).__name__} ({node.placement})")
+        return subgraphs
+
+    def __make_handler(self, label, graph):
+        path = self.reportPath.format(label=label) if self.reportPath else None
+        return AsyncHandler(graph, self.reportInterval, path, self.reportFmt)
+
+    def add_metrics_source(self, name, fx):
+        """
+        See AsyncHandler.add_metrics_source. Reported by the calling process only.
+        """
+        self.__extra[name] = fx
+
+    def get_metrics(self):
+        """
+        Metrics for the stages running in the calling process. Forked processes
+        only report through reportPath.
+        """
+        return self.__local.get_metrics() if self.__local is not None else {}
+
+    def __child_main(self, label, graph):
+        # Shutdown comes down the pipeline as a None, don't let ctrl+c kill us before it gets here
+        signal.signal(signal.SIGINT,  signal.SIG_IGN)
+        signal.signal(signal.SIGTERM, signal.SIG_IGN)
+        if self.childInit:
+            self.childInit(label)
+
+        # The parent's loop came along with the fork and shares its epoll instance. Closing
+        # it here, which happens if it's garbage collected, would unregister the parent's own
+        # fds and it would miss wakeups. Keep it alive and untouched, children exit with os._exit.
+        _INHERITED_LOOPS.append(asyncio.get_event_loop_policy().get_event_loop())
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        print(f"[PC Model] > Process {os.getpid()} running placement '{label}'")
+        self.__make_handler(label, graph).run()
+        loop.close()
+
+    def __on_exit(self, proc):
+        """
+        A child is done. If it failed, end every stream so nothing waits on it forever.
+        """
+        proc.join()
+        if proc.exitcode and not any(ring.aborted.is_set() for ring in self.__rings):
+            print(f"[PC Model] > Process {proc.pid} running '{proc.name}' failed with exit code {proc.exitcode}, stopping the pipeline")
+            for ring in self.__rings:
+                ring.abort()
+
+    def run(self):
+        """
+        Runs the graph that was registered, blocks until every process is done
+        """
+        if not self.mGraph:
+            raise RuntimeError("Invalid model Configuraiton: no model graph supplied")
+
+        if self.mGraph.is_empty():
+            raise RuntimeError("Invalid model Configuraiton: no nodes in model graph")
+
+        subgraphs = self.partition()
+        local = subgraphs.pop(None, None)
+
+        for label, graph in subgraphs.items():
+            proc = _FORK_CTX.Process(target=self.__child_main, args=(label, graph), name=f"pc_{label}", daemon=True)
+            proc.start()
+            self.__procs.append(proc)
+
+        try:
+            if local is not None:
+                self.__local = self.__make_handler(self.LOCAL_LABEL, local)
+                for name, fx in self.__extra.items():
+                    self.__local.add_metrics_source(name, fx)
+                # Watch for children exiting from the same loop the stages run on
+                loop = asyncio.get_event_loop()
+                def on_exit(proc):
+                    loop.remove_reader(proc.sentinel)
+                    self.__on_exit(proc)
+                for proc in self.__procs:
+                    loop.add_reader(proc.sentinel, on_exit, proc)
+                try:
+                    self.__local.run()
+                finally:
+                    for proc in self.__procs:
+                        loop.remove_reader(proc.sentinel)
+
+            pending = list(self.__procs)
+            while pending:
+                for sentinel in wait([proc.sentinel for proc in pending]):
+                    proc = next(proc for proc in pending if proc.sentinel == sentinel)
+                    pending.remove(proc)
+                    self.__on_exit(proc)
+
+            failed = [f"{proc.name} ({proc.exitcode})" for proc in self.__procs if proc.exitcode]
+            if failed:
+                raise RuntimeError(f"Pipeline process(es) failed: {', '.join(failed)}")
+        except BaseException:
+            # Children reading from us would wait for their next packet forever, and
+            # ones writing to us for a free slot
+            for ring in self.__rings:
+                ring.abort()
+            for proc in self.__procs:
+                proc.join(self.shutdownTimeout)
+                if proc.is_alive():
+                    # Children ignore SIGTERM (see __child_main), and can be stuck flushing to a queue we no longer read
+                    print(f"[PC Model] > Process {proc.pid} didn't shut down, killing it")
+                    proc.kill()
+                    proc.join()
+            raise
+        finally:
+            for ring in self.__rings:
+                ring.close(unlink=True)
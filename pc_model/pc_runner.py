@@ -18,10 +18,66 @@ The stages in this class (other than BaseStage) assume None to be a sentinel val
 
 """
 from pc_model.pc_graph import BaseNode, Graph
+from pc_model.pc_metrics import write_snapshot
 import asyncio
+import os
+import time
 class AsyncHandler():
-    def __init__(self, mGraph: Graph = None):
+    def __init__(self, mGraph: Graph = None, reportInterval = None, reportPath = None, reportFmt = "json"):
+        """
+        reportInterval: Seconds between metrics snapshots while running (None = never).
+        reportPath:     File each snapshot replaces (None = print it).
+        reportFmt:      "json" or "text"
+        """
         self.mGraph: Graph = mGraph
+        self.reportInterval = reportInterval
+        self.reportPath     = reportPath
+        self.reportFmt      = reportFmt
+        self.__extra        = {}
+
+    def add_metrics_source(self, name, fx):
+        """
+        Include fx() (anything json serializable) in every metrics snapshot under
+        name. For things outside the graph like the audio buffer.
+        """
+        self.__extra[name] = fx
+
+    def get_metrics(self):
+        """
+        Snapshot of every stage's metrics, keyed by "<position in graph>:<stage type>"
+        """
+        stages = {}
+        for i, node in enumerate(self.mGraph):
+            metrics = getattr(node.data, "metrics", None)
+            if metrics is not None:
+                stages[f"{i}:{metrics.name}"] = metrics.snapshot()
+        return {
+            "time"   : time.time(),
+            "pid"    : os.getpid(),
+            "stages" : stages,
+            "extra"  : {name : fx() for name, fx in self.__extra.items()},
+        }
+
+    async def __report(self):
+        while True:
+            await asyncio.sleep(self.reportInterval)
+            write_snapshot(self.reportPath, self.get_metrics(), self.reportFmt)
+
+    async def __run_all(self, coros):
+        reporter = asyncio.ensure_future(self.__report()) if self.reportInterval else None
+        tasks = [asyncio.ensure_future(c) for c in coros]
+        try:
+            await asyncio.gather(*tasks)
+        except BaseException:
+            # gather leaves the other stages running, stop them so none are left pending
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
+        finally:
+            if reporter is not None:
+                reporter.cancel()
+                write_snapshot(self.reportPath, self.get_metrics(), self.reportFmt)
     
     def run(self):
         """
@@ -45,4 +101,4 @@ class AsyncHandler():
         coros = [n.data.get_coro() for n in self.mGraph]
 
         print("[PC Model] > Running a model")
-        loop.run_until_complete(asyncio.gather(*coros))
\ No newline at end of file
+        loop.run_until_complete(self.__run_all(coros))
\ No newline at end of file
@@ -5,7 +5,72 @@
 # producer-consumer network
 
 from abc import ABC, abstractmethod
+from enum import Enum, auto
+from concurrent.futures import ThreadPoolExecutor
 import asyncio
+import os
+import time
+
+from pc_model.pc_metrics import StageMetrics
+
+class ExecPolicy(Enum):
+    INLINE = auto() # process() / inspect() run on the event loop, everything else waits on them
+    THREAD = auto() # Run on a worker thread, event loop (and other stages) keep going
+
+_SHARED_EXECUTOR     = None
+_SHARED_EXECUTOR_PID = None
+def get_shared_executor():
+    """
+    Thread pool shared by every stage using ExecPolicy.THREAD without its own executor.
+    Made lazily (and remade after a fork) so each process gets its own threads.
+    """
+    global _SHARED_EXECUTOR, _SHARED_EXECUTOR_PID
+    if _SHARED_EXECUTOR is None or _SHARED_EXECUTOR_PID != os.getpid():
+        _SHARED_EXECUTOR     = ThreadPoolExecutor(max_workers=os.cpu_count(), thread_name_prefix="pc_stage")
+        _SHARED_EXECUTOR_PID = os.getpid()
+    return _SHARED_EXECUTOR
+
+class DropPolicy(Enum):
+    BLOCK       = auto() # Producer waits for room (backpressure)
+    DROP_OLDEST = auto() # Oldest queued packet is thrown out to make room
+    DROP_NEWEST = auto() # Packet being put is thrown out
+
+class EdgeQueue(asyncio.Queue):
+    """
+    Queue between a producer and its consumers. capacity <= 0 is unbounded.
+    When full, what happens on put depends on policy. None (end of stream) is
+    never dropped. onDrop(packet) is called for every dropped packet so things like
+    pooled buffers can be given back. Packets put are recorded on metrics if set.
+    """
+    def __init__(self, capacity = 0, policy = DropPolicy.BLOCK, onDrop = None, metrics: StageMetrics = None):
+        super().__init__(maxsize=capacity)
+        self.policy     = policy
+        self.onDrop     = onDrop
+        self.numDropped = 0
+        self.metrics    = metrics
+        if metrics is not None:
+            metrics.queue = self
+
+    def __drop(self, pkt):
+        self.numDropped += 1
+        if self.onDrop is not None:
+            self.onDrop(pkt)
+
+    async def put(self, item):
+        if item is None or self.policy == DropPolicy.BLOCK or not self.full():
+            t0 = time.perf_counter_ns()
+            await super().put(item)
+            if item is not None and self.metrics is not None:
+                self.metrics.record_out(item, self.qsize(), time.perf_counter_ns() - t0)
+            return
+
+        if self.policy == DropPolicy.DROP_NEWEST:
+            self.__drop(item)
+            return
+        self.__drop(self.get_nowait())
+        self.put_nowait(item)
+        if self.metrics is not None:
+            self.metrics.record_out(item, self.qsize(), 0)
 
 class BaseProducer(ABC):
     """
@@ -13,12 +78,49 @@ class BaseProducer(ABC):
     """
     def __init__(self, **kwargs):
         super().__init__()
-        self.outbox = asyncio.Queue()
+        self.metrics = getattr(self, "metrics", None) or StageMetrics(type(self).__name__)
+        self.outbox = EdgeQueue(metrics=self.metrics)
         self.__num_consumers = 0
+        self.execPolicy = ExecPolicy.INLINE
+        self.executor   = None
     
     def add_consumer(self):
         self.__num_consumers += 1
 
+    def set_outbox_policy(self, capacity, policy: DropPolicy = DropPolicy.BLOCK, onDrop = None):
+        """
+        Bound the queue between this stage and whatever consumes from it. Must be
+        called before the graph is run. Returns self so it can be used inline when
+        building a graph.
+        """
+        self.outbox = EdgeQueue(capacity, policy, onDrop, self.metrics)
+        return self
+
+    def set_exec_policy(self, policy: ExecPolicy, executor = None):
+        """
+        Choose where this stage's work runs. A stage only ever has one call in flight
+        so packets stay in order, but THREAD stages can overlap with each other as long
+        as the work releases the GIL (most numpy / scipy kernels do).
+        Returns self so it can be used inline when building a graph.
+        """
+        self.execPolicy = policy
+        self.executor   = executor
+        return self
+
+    async def run_work(self, fx, *args):
+        """
+        Call fx(*args) according to the execution policy. Time spent is recorded
+        on this stage's metrics.
+        """
+        t0 = time.perf_counter_ns()
+        if self.execPolicy == ExecPolicy.INLINE:
+            res = fx(*args)
+        else:
+            executor = self.executor if self.executor is not None else get_shared_executor()
+            res = await asyncio.get_running_loop().run_in_executor(executor, fx, *args)
+        self.metrics.record_work(time.perf_counter_ns() - t0)
+        return res
+
     async def get_result(self):
         return await self.outbox.get()
 
@@ -39,6 +141,7 @@ class BaseConsumer(ABC):
     """
     def __init__(self, source=None, **kwargs):
         super().__init__()
+        self.metrics = getattr(self, "metrics", None) or StageMetrics(type(self).__name__)
         if source:
             self.register_source(source)
 
@@ -47,6 +150,15 @@ class BaseConsumer(ABC):
             raise TypeError(f"Expected BaseProducer, got {type(source).__name__}")
         self.source = source
         source.add_consumer()
+
+    async def pull(self):
+        """
+        Get the next packet from source, recording it on this stage's metrics
+        """
+        pkt = await self.source.get_result()
+        if pkt is not None:
+            self.metrics.record_in(pkt)
+        return pkt
     
     def get_coro(self):
         return self.consume()
@@ -66,11 +178,11 @@ class AbstractWorker(BaseProducer, BaseConsumer):
         super().__init__(source=source)
 
     async def consume(self):
-        return await self.source.get_result()
+        return await self.pull()
     
     async def produce(self):
         while (data := await self.consume()) is not None:
-            await self.outbox.put(self.process(data))
+            await self.outbox.put(await self.run_work(self.process, data))
         await self.stop()
 
 
@@ -90,11 +202,11 @@ class AbstractWindow(BaseProducer, BaseConsumer):
         super().__init__(source=source)
 
     async def consume(self):
-        return await self.source.get_result()
+        return await self.pull()
     
     async def produce(self):
         while (data := await self.consume()) is not None:
-            self.inspect(data)
+            await self.run_work(self.inspect, data)
             await self.outbox.put(data)
         await self.stop()
 
@@ -0,0 +1,229 @@
+"""
+Long running recordings of pipeline samples to disk in SigMF format.
+
+A recording is a sequence of files <prefix>_<start time>_<n>.sigmf-data, each with
+a .sigmf-meta next to it (https://sigmf.org). A new file is started whenever the
+current one reaches maxBytes or has been open for maxSeconds.
+
+Writes never hold up the caller. Samples are copied into a handful of large batch
+buffers which a writer thread flushes to disk in one write each. If the disk falls
+so far behind that every batch buffer is full, incoming samples are dropped (and
+counted) rather than waiting on it.
+"""
+import datetime
+import json
+import os
+import threading
+import time
+from queue import Queue
+
+import numpy as np
+
+from buffer_pool import BufferPool
+
+# numpy dtype -> SigMF core:datatype
+SIGMF_DATATYPES = {
+    np.dtype(np.complex64)  : "cf32_le",
+    np.dtype(np.complex128) : "cf64_le",
+    np.dtype(np.float32)    : "rf32_le",
+    np.dtype(np.float64)    : "rf64_le",
+    np.dtype(np.uint8)      : "ru8",
+}
+
+def _iso_now():
+    return datetime.datetime.now(datetime.timezone.utc).isoformat().replace("+00:00", "Z")
+
+class SigMFRecording():
+    """
+    Writes batches of samples to rotating SigMF files. Call write() and close()
+    from a single thread (RecordingWriter's writer thread).
+    """
+    def __init__(self, prefix, fs, dtype, maxBytes = None, maxSeconds = None, description = ""):
+        self.prefix      = prefix
+        self.fs          = fs
+        self.dtype       = np.dtype(dtype)
+        self.maxBytes    = maxBytes
+        self.maxSeconds  = maxSeconds
+        self.description = description
+        self.filesMade   = []
+        self.__fhandle   = None
+        self.__start     = time.strftime("%Y%m%d-%H%M%S")
+        self.__captures  = []
+        self.__annots    = []
+        self.__segment   = None # (cf, gain) of the capture segment being written
+        self.__nBytes    = 0
+        self.__opened    = 0
+
+        if self.dtype not in SIGMF_DATATYPES:
+            raise ValueError(f"Can't record {self.dtype}, expected one of {list(SIGMF_DATATYPES)}")
+
+    def __path(self):
+        return f"{self.prefix}_{self.__start}_{len(self.filesMade):03d}"
+
+    def __open(self):
+        d = os.path.dirname(self.prefix)
+        if d:
+            os.makedirs(d, exist_ok=True)
+        self.filesMade.append(self.__path())
+        self.__fhandle  = open(self.filesMade[-1] + ".sigmf-data", "wb")
+        self.__captures = []
+        self.__annots   = []
+        self.__segment  = None
+        self.__nBytes   = 0
+        self.__opened   = time.monotonic()
+
+    def __finish(self):
+        if self.__fhandle is None:
+            return
+        self.__fhandle.close()
+        self.__fhandle = None
+        meta = {
+            "global" : {
+                "core:datatype"    : SIGMF_DATATYPES[self.dtype],
+                "core:sample_rate" : self.fs,
+                "core:version"     : "1.0.0",
+                "core:recorder"    : "sdr_scanner",
+                "core:description" : self.description,
+            },
+            "captures"    : self.__captures,
+            "annotations" : self.__annots,
+        }
+        with open(self.filesMade[-1] + ".sigmf-meta", "w") as f:
+            json.dump(meta, f, indent=1)
+
+    def __due_rotation(self, nBytes):
+        if self.__fhandle is None:
+            return True
+        if self.maxBytes and self.__nBytes and self.__nBytes + nBytes > self.maxBytes:
+            return True
+        return bool(self.maxSeconds) and time.monotonic() - self.__opened > self.maxSeconds
+
+    def write(self, buf, segments):
+        """
+        Append buf (bytes-like) to the recording. segments lists where in buf new
+        capture segments start as (byte offset, cf, gain, gap, wall time). A gap means
+        samples were skipped (squelch, drops) just before that point.
+        """
+        if self.__due_rotation(len(buf)):
+            self.__finish()
+            self.__open()
+
+        itemSize = self.dtype.itemsize
+        for offset, cf, gain, gap, wall in segments:
+            start = (self.__nBytes + offset) // itemSize
+            # Recording starts or resumes, or the tuning changed: new capture segment
+            if gap or self.__segment != (cf, gain) or not self.__captures:
+                capture = {"core:sample_start" : start, "core:datetime" : wall}
+                if cf is not None:
+                    capture["core:frequency"] = cf
+                if gain is not None:
+                    capture["sdr_scanner:gain"] = gain
+                self.__captures.append(capture)
+            if self.__segment is not None and self.__segment[1] != gain:
+                self.__annots.append({"core:sample_start" : start, "core:sample_count" : 0, "core:comment" : f"gain {self.__segment[1]} -> {gain}"})
+            self.__segment = (cf, gain)
+
+        self.__fhandle.write(buf)
+        self.__nBytes += len(buf)
+
+    def close(self):
+        self.__finish()
+
+class RecordingWriter():
+    """
+    Non blocking front end to a SigMFRecording. append() copies samples into the
+    current batch buffer, full batches go to a writer thread through a queue.
+    batchBytes sets the size of every disk write, numBatches how much can be
+    waiting on the disk before samples get dropped.
+    """
+    def __init__(self, recording: SigMFRecording, batchBytes = 2**22, numBatches = 4):
+        self.recording  = recording
+        self.itemSize   = recording.dtype.itemsize
+        self.batchLen   = batchBytes // self.itemSize
+        self.pool       = BufferPool((self.batchLen,), recording.dtype, prealloc=numBatches, maxFree=numBatches, limit=numBatches)
+        self.numDropped = 0 # Samples that didn't make it to disk
+        self.__q        = Queue()
+        self.__batch    = None
+        self.__batchLen = 0
+        self.__segments = []
+        self.__gap      = True
+        self.__thread   = threading.Thread(target=self.__write_worker, name="recorder", daemon=True)
+        self.__thread.start()
+
+    def __write_worker(self):
+        while (item := self.__q.get()) is not None:
+            batch, n, segments = item
+            self.recording.write(memoryview(batch[:n]).cast("B"), segments)
+            self.pool.release(batch)
+        self.recording.close()
+
+    def __flush(self):
+        if self.__batch is not None and self.__batchLen:
+            self.__q.put((self.__batch, self.__batchLen, self.__segments))
+        elif self.__batch is not None:
+            self.pool.release(self.__batch)
+        self.__batch    = None
+        self.__batchLen = 0
+        self.__segments = []
+
+    def append(self, x, cf = None, gain = None):
+        """
+        Queue samples x for writing. cf / gain describe how they were captured.
+        """
+        x = np.asarray(x, dtype=self.recording.dtype)
+        wall = _iso_now()
+        pos = 0
+        while pos < len(x):
+            if self.__batch is None:
+                self.__batch = self.pool.acquire()
+                if self.__batch is None:
+                    # Disk is behind and every batch is waiting on it. Drop rather than stall.
+                    self.numDropped += len(x) - pos
+                    self.__gap = True
+                    return
+            self.__segments.append((self.__batchLen * self.itemSize, cf, gain, self.__gap, wall))
+            self.__gap = False
+
+            n = min(len(x) - pos, self.batchLen - self.__batchLen)
+            self.__batch[self.__batchLen:self.__batchLen + n] = x[pos:pos + n]
+            self.__batchLen += n
+            pos += n
+            if self.__batchLen == self.batchLen:
+                self.__flush()
+
+    def mark_gap(self):
+        """
+        Samples are being skipped (e.g. squelch closed). The next append starts a new
+        capture segment.
+        """
+        self.__gap = True
+
+    def close(self):
+        """
+        Flush what's buffered and wait for it to reach the disk
+        """
+        self.__flush()
+        self.__q.put(None)
+        self.__thread.join()
+
+
+def __testing():
+    import tempfile
+    with tempfile.TemporaryDirectory() as d:
+        rec = SigMFRecording(os.path.join(d, "test"), 250e3, np.complex64, maxBytes=2**16)
+        w   = RecordingWriter(rec, batchBytes=2**14, numBatches=8)
+        x   = (np.arange(3000) * (1 + 1j)).astype(np.complex64)
+        w.append(x, cf=100e6, gain=20)
+        w.mark_gap()
+        w.append(x, cf=100e6, gain=30)
+        w.append(x, cf=101e6, gain=30)
+        w.close()
+
+        data = np.concatenate([np.fromfile(f + ".sigmf-data", np.complex64) for f in rec.filesMade])
+        print(f"{len(rec.filesMade)} files, {len(data)} samples, intact: {np.array_equal(data, np.tile(x, 3)[:len(data)])}, dropped {w.numDropped}")
+        with open(rec.filesMade[0] + ".sigmf-meta") as f:
+            meta = json.load(f)
+        print(json.dumps(meta["captures"]), json.dumps(meta["annotations"]))
+
+if __name__ == "__main__":
+    __testing()
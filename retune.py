@@ -0,0 +1,201 @@
+"""
+Retuning the dongle without stalling whoever asked for it, and without playing
+what was captured on the old frequency.
+
+Every retune starts a new generation. Chunks are stamped with the generation
+that was in force when their first sample was captured (see StampGeneration in
+system_pipeline_stages) and anything older than the current generation is
+thrown away wherever it happens to be in the pipeline (DropStale). Listeners
+(the audio ring) are told about each retune so they can drop what they hold too.
+
+Retunes that stay close to where the dongle is tuned don't touch the dongle at
+all. The chunks are mixed by the difference instead (see FineTune), which takes
+effect from the very next chunk and needs no settle time.
+"""
+import threading
+import time
+from collections import deque
+
+from pc_model.pc_metrics import LatencyHistogram
+
+class RetuneScheduler():
+    """
+    request() only records the frequency wanted and returns. A worker thread does
+    the actual retune, at most once every minInterval seconds: a lone request goes
+    through right away, a burst of them (a button held down) turns into one
+    retune to the newest frequency every minInterval, ending on the last one.
+
+    tune(freq) is what actually retunes the hardware. Samples captured up to
+    settle seconds after it returns still belong to the previous generation.
+
+    hwFreq is where the hardware is tuned to start with. maxOffset() gives how far
+    (Hz) from hwFreq a frequency can be and still be reached digitally, None
+    always retunes the hardware.
+    """
+    def __init__(self, tune, minInterval = 0.25, settle = 0.02, hwFreq = None, maxOffset = None, clock = time.perf_counter):
+        self.tune        = tune
+        self.minInterval = minInterval
+        self.settle      = settle
+        self.maxOffset   = maxOffset
+        self.clock       = clock
+        self.generation  = 0
+        self.hwFreq      = hwFreq
+        self.offset      = 0.0                # Where we're listening, relative to hwFreq
+        self.freq        = hwFreq
+        self.listeners   = []                 # Called with the new generation after every retune
+        self.latency     = LatencyHistogram() # First request of a burst -> hardware retuned
+        self.heardAfter  = LatencyHistogram() # First request of a burst -> first new chunk reaches the speakers
+        self.numRequests = 0
+        self.numRetunes  = 0
+        self.numDigital  = 0                  # Retunes that only changed the offset
+        self.numStale    = 0                  # Chunks dropped for being from an old generation
+        self.__cv        = threading.Condition()
+        self.__pending   = None
+        self.__firstReq  = None
+        self.__lastTune  = -float("inf")
+        self.__history   = deque([(-float("inf"), 0, 0.0, hwFreq)], maxlen=16) # (settled at, generation, offset, hwFreq)
+        self.__unsettled = deque(maxlen=16)   # (started, settled at) of each hardware retune
+        self.__tuningAt  = None               # When the hardware retune in progress started
+        self.__unheard   = {}                 # generation -> when it was first asked for
+        self.__thread    = None
+
+    def add_listener(self, fx):
+        self.listeners.append(fx)
+
+    def request(self, freq):
+        """
+        Ask for a retune to freq. Returns immediately.
+        """
+        with self.__cv:
+            self.__pending = freq
+            if self.__firstReq is None:
+                self.__firstReq = self.clock()
+            self.numRequests += 1
+            if self.__thread is None:
+                self.__thread = threading.Thread(target=self.__worker, name="retune", daemon=True)
+                self.__thread.start()
+            self.__cv.notify()
+
+    def __is_digital(self, freq):
+        return self.hwFreq is not None and self.maxOffset is not None and abs(freq - self.hwFreq) <= self.maxOffset()
+
+    def __apply(self, freq, requested):
+        digital = self.__is_digital(freq)
+        if not digital:
+            with self.__cv:
+                self.__tuningAt = self.clock()
+            self.tune(freq)
+        done = self.clock()
+        with self.__cv:
+            self.generation += 1
+            self.freq        = freq
+            self.numRetunes += 1
+            self.__lastTune  = done
+            if digital:
+                self.offset      = freq - self.hwFreq
+                self.numDigital += 1
+                self.__history.append((done, self.generation, self.offset, self.hwFreq))
+            else:
+                self.hwFreq = freq
+                self.offset = 0.0
+                self.__history.append((done + self.settle, self.generation, self.offset, self.hwFreq))
+                self.__unsettled.append((self.__tuningAt, done + self.settle))
+                self.__tuningAt = None
+            self.__unheard   = {self.generation : requested}
+            gen = self.generation
+        self.latency.record(int((done - requested) * 1e9))
+        for fx in self.listeners:
+            fx(gen)
+
+    def __worker(self):
+        while True:
+            with self.__cv:
+                while self.__pending is None:
+                    self.__cv.wait()
+                # Newer requests just replace the pending one while we wait our turn
+                while (wait := self.__lastTune + self.minInterval - self.clock()) > 0:
+                    self.__cv.wait(wait)
+                freq, requested = self.__pending, self.__firstReq
+                self.__pending  = None
+                self.__firstReq = None
+            self.__apply(freq, requested)
+
+    def tuning_at(self, t):
+        """
+        (generation, offset, hwFreq) in force for a sample captured at t (time.perf_counter()).
+        hwFreq is where the dongle was tuned, the sample is centred there and not on
+        hwFreq + offset until FineTune has mixed it.
+        """
+        with self.__cv:
+            for settledAt, gen, offset, hwFreq in reversed(self.__history):
+                if settledAt <= t:
+                    return gen, offset, hwFreq
+            return self.__history[0][1:]
+
+    def is_settled(self, t0, t1):
+        """
+        Whether the dongle held still for every sample captured from t0 to t1, i.e.
+        no hardware retune was in progress or settling. Digital retunes don't count,
+        each chunk is mixed by the offset in force for its first sample.
+        """
+        with self.__cv:
+            if self.__tuningAt is not None and self.__tuningAt <= t1:
+                return False
+            return not any(started <= t1 and settledAt > t0 for started, settledAt in self.__unsettled)
+
+    def generation_at(self, t):
+        return self.tuning_at(t)[0]
+
+    def is_stale(self, gen):
+        """
+        Whether a chunk stamped with gen should be thrown away. Counts the ones that are.
+        """
+        if gen is None or gen >= self.generation:
+            return False
+        self.numStale += 1
+        return True
+
+    def mark_heard(self, gen):
+        """
+        A chunk of generation gen reached the speakers
+        """
+        requested = self.__unheard.pop(gen, None)
+        if requested is not None:
+            self.heardAfter.record(int((self.clock() - requested) * 1e9))
+
+    def get_stats(self):
+        return {
+            "generation"  : self.generation,
+            "freq"        : self.freq,
+            "requests"    : self.numRequests,
+            "retunes"     : self.numRetunes,
+            "digital"     : self.numDigital,
+            "offset"      : self.offset,
+            "stale"       : self.numStale,
+            "latency"     : self.latency.summary(),
+            "heard_after" : self.heardAfter.summary(),
+        }
+
+
+def __testing():
+    tuned = []
+    def tune(freq):
+        time.sleep(0.005) # Roughly a USB control transfer or two
+        tuned.append(freq)
+
+    rs = RetuneScheduler(tune, minInterval=0.25, hwFreq=100e6, maxOffset=lambda : 5e3)
+    # Held button: a request every 100 ms for a second and a half
+    for i in range(16):
+        rs.request(100e6 + i * 1e3)
+        time.sleep(0.1)
+    time.sleep(0.4)
+    print(f"{rs.numRequests} requests -> {rs.numRetunes} retunes, {len(tuned)} of them in hardware, "
+          f"ended on {rs.freq:.0f} Hz = {rs.hwFreq:.0f} Hz {rs.offset:+.0f} Hz")
+    print(f"Generation of a chunk captured now: {rs.generation_at(time.perf_counter())}, just before the last retune: "
+          f"{rs.generation_at(time.perf_counter() - 0.5)}")
+    now = time.perf_counter()
+    print(f"Dongle held still for the last 100 ms: {rs.is_settled(now - 0.1, now)}, the last 2 s: {rs.is_settled(now - 2, now)}")
+    print(rs.get_stats())
+
+if __name__ == "__main__":
+    __testing()
@@ -0,0 +1,237 @@
+"""
+Scan engine: steps the tuner through a list of channels looking for activity.
+
+Each channel is listened to for dwell seconds once the tuner has settled. If the
+squelch opens the scan stops there and stays until the squelch has been closed
+for hang seconds. Priority channels are checked every priorityInterval seconds,
+even while another channel is being listened to, and take over if they're
+active. Locked out channels are skipped.
+
+The scanner is driven from two places in the pipeline (see StampTuning and
+ReportSquelch in system_pipeline_stages):
+- tick() runs as chunks come off the dongle. Timers run on capture time here,
+  so a channel is left the moment its dwell has been captured instead of after
+  its last chunk has made it through the pipeline (retuning ahead). tuned() is
+  called from here too, once chunks captured at the new frequency show up,
+  since tune() only asks for the retune and returns.
+- report() runs once a chunk's squelch decision is known. Chunks partly
+  captured before the tuner settled never get here, they're dropped.
+
+If a squelch break shows up for the channel that was just left, the scanner goes
+back to it, so getting ahead of the pipeline doesn't miss anything.
+"""
+import time
+from enum import Enum, auto
+
+class ScanState(Enum):
+    SCAN     = auto() # Dwelling on a channel, moves on when the dwell is up
+    RECEIVE  = auto() # Squelch open, staying put
+    HANG     = auto() # Squelch closed, waiting out the hang time before moving on
+    PRIORITY = auto() # Taking a quick look at the priority channels
+
+class Scanner():
+    """
+    channels:         Frequencies (Hz) to step through, in order
+    tune:             Called with a frequency to retune the dongle, may return before it's done
+    priority:         Frequencies to check every priorityInterval seconds
+    lockouts:         Frequencies to skip
+    dwell:            Seconds to listen to each channel once settled
+    hang:             Seconds the squelch has to stay closed before moving on
+
+    The dwell on a channel starts when tuned() says samples captured there can be
+    trusted, however long the retune took.
+    """
+    def __init__(self, channels, tune, priority = (), lockouts = (), dwell = 0.1, hang = 2.0,
+                 priorityInterval = 2.0, clock = time.perf_counter):
+        self.channels         = list(channels)
+        self.tune             = tune
+        self.priority         = set(priority)
+        self.lockouts         = set(lockouts)
+        self.dwell            = dwell
+        self.hang             = hang
+        self.priorityInterval = priorityInterval
+        self.clock            = clock
+
+        self.state     = ScanState.SCAN
+        self.freq      = None # Where the tuner is now
+        self.settledAt = 0    # Capture time from which samples at freq can be trusted, inf until tuned()
+        self.numTunes  = 0
+        self.numBreaks = 0
+        self.__idx        = -1
+        self.__prevFreq   = None # Channel left most recently while scanning
+        self.__deadline   = 0    # When the dwell (SCAN / PRIORITY) is up
+        self.__hangUntil  = 0
+        self.__nextPrio   = 0
+        self.__prioQueue  = []
+        self.__resume     = None # (freq, state) to go back to after a priority check
+        self.__started    = None
+
+    def __retune(self, freq):
+        if freq == self.freq:
+            self.settledAt  = self.clock()
+            self.__deadline = self.settledAt + self.dwell
+            return
+        # Nothing moves on until tuned() says the tuner got there
+        self.freq       = freq
+        self.settledAt  = float("inf")
+        self.__deadline = float("inf")
+        self.numTunes  += 1
+        self.tune(freq)
+
+    def __next_channel(self):
+        for _ in range(len(self.channels)):
+            self.__idx = (self.__idx + 1) % len(self.channels)
+            if self.channels[self.__idx] not in self.lockouts:
+                return self.channels[self.__idx]
+
+    def __scan_on(self):
+        freq = self.__next_channel()
+        self.state = ScanState.SCAN
+        if freq is not None:
+            if self.freq is not None:
+                self.__prevFreq = self.freq
+            self.__retune(freq)
+
+    def __start_priority_check(self, now):
+        queue = [f for f in self.channels if f in self.priority and f not in self.lockouts and f != self.freq]
+        self.__nextPrio = now + self.priorityInterval
+        if not queue:
+            return False
+        self.__resume    = (self.freq, self.state)
+        self.__prioQueue = queue
+        self.__prevFreq  = None
+        self.state       = ScanState.PRIORITY
+        self.__retune(self.__prioQueue.pop(0))
+        return True
+
+    def __end_priority_check(self, now):
+        self.__nextPrio = now + self.priorityInterval
+        freq, state = self.__resume
+        self.__resume = None
+        if state == ScanState.SCAN or freq in self.lockouts:
+            self.__scan_on()
+        else:
+            # Back to the channel we were listening to, its squelch decides where we go from there
+            self.state = ScanState.RECEIVE
+            self.__retune(freq)
+
+    def start(self):
+        """
+        Tune to the first channel
+        """
+        now = self.clock()
+        self.__started  = now
+        self.__nextPrio = now + self.priorityInterval
+        self.__scan_on()
+
+    def tick(self, now = None):
+        """
+        Run the timers. now is the capture time of the newest chunk.
+        """
+        now = self.clock() if now is None else now
+        if self.__started is None:
+            self.start()
+            return
+
+        prioDue = self.priority and now >= self.__nextPrio and self.freq not in self.priority
+        if self.state == ScanState.SCAN:
+            if now >= self.__deadline:
+                if not (prioDue and self.__start_priority_check(now)):
+                    self.__scan_on()
+        elif self.state == ScanState.PRIORITY:
+            if now >= self.__deadline:
+                if self.__prioQueue:
+                    self.__retune(self.__prioQueue.pop(0))
+                else:
+                    self.__end_priority_check(now)
+        elif self.state == ScanState.HANG and now >= self.__hangUntil:
+            self.__scan_on()
+        elif prioDue:
+            self.__start_priority_check(now)
+
+    def report(self, freq, now, isOpen):
+        """
+        Squelch decision for a settled chunk captured at freq, ending at capture time now
+        """
+        if freq != self.freq:
+            # Verdict on the channel we just left the moment its dwell was captured. If it broke
+            # squelch after all, go back to it.
+            if isOpen and self.state == ScanState.SCAN and freq == self.__prevFreq and freq not in self.lockouts:
+                print(f"[Scanner] > Late squelch break on {freq / 1e6:.4f} MHz, going back")
+                self.numBreaks += 1
+                self.state = ScanState.RECEIVE
+                self.__retune(freq)
+            return
+
+        if self.state in (ScanState.SCAN, ScanState.PRIORITY):
+            if isOpen:
+                print(f"[Scanner] > Squelch break on {freq / 1e6:.4f} MHz")
+                self.numBreaks += 1
+                self.state    = ScanState.RECEIVE
+                self.__resume = None
+        elif self.state == ScanState.RECEIVE:
+            if freq in self.lockouts:
+                self.__scan_on()
+            elif not isOpen:
+                self.state = ScanState.HANG
+                self.__hangUntil = now + self.hang
+        elif self.state == ScanState.HANG and isOpen:
+            self.state = ScanState.RECEIVE
+
+    def tuned(self, freq, t):
+        """
+        Samples at freq can be trusted from capture time t on. Starts the dwell if
+        freq is where the scanner is waiting to be.
+        """
+        if freq == self.freq and self.settledAt == float("inf"):
+            self.settledAt  = t
+            self.__deadline = t + self.dwell
+
+    def lock_out(self, freq):
+        self.lockouts.add(freq)
+
+    def unlock(self, freq):
+        self.lockouts.discard(freq)
+
+    def get_stats(self):
+        elapsed = self.clock() - self.__started if self.__started is not None else 0
+        return {
+            "state"            : self.state.name,
+            "freq"             : self.freq,
+            "tunes"            : self.numTunes,
+            "breaks"           : self.numBreaks,
+            "channels_per_sec" : self.numTunes / elapsed if elapsed else 0.0,
+        }
+
+
+def __testing():
+    # Simulated clock and band: 3 channels, 2 of them active at times, 1 priority
+    t = [0.0]
+    active = {100e6 : [(1.0, 1.5)], 102e6 : [(0.2, 3.0)]}
+    def is_active(f, now):
+        return any(a <= now < b for a, b in active.get(f, []))
+
+    # The simulated tuner gets where it's asked 5 ms later
+    requested = []
+    s = Scanner([100e6, 101e6, 102e6, 103e6], tune=lambda f: requested.append((f, t[0] + 0.005)), priority=[100e6],
+                lockouts=[103e6], dwell=0.05, hang=0.3, priorityInterval=0.5, clock=lambda: t[0])
+    chunk = 0.01
+    visits = []
+    while t[0] < 4:
+        t[0] += chunk
+        for f, at in requested:
+            s.tuned(f, at)
+        requested.clear()
+        freq, settled = s.freq, t[0] - chunk >= s.settledAt
+        s.tick(t[0])
+        if freq is not None and settled:
+            s.report(freq, t[0], is_active(freq, t[0]))
+        if not visits or visits[-1][1] != (s.freq, s.state):
+            visits.append((round(t[0], 2), (s.freq, s.state)))
+    for when, (f, state) in visits:
+        if state != ScanState.SCAN:
+            print(f"{when:5.2f} s  {f / 1e6:6.1f} MHz  {state.name}")
+    print(s.get_stats())
+
+if __name__ == "__main__":
+    __testing()
@@ -1,7 +1,7 @@
-import sounddevice as sd
 import numpy as np
-from queue import Queue, Empty
 import threading
+import time as systime
+from audio_ring import AudioRing
 
 class SpeakerManager():
     def __init__(self, sampRate = 44100, blockSize = 2**12, chunkSrc = None):
@@ -10,23 +10,55 @@ class SpeakerManager():
         self.sampRate  = sampRate
         self.stream    = None
         self.isInit    = False
+        self.pool      = None
 
-    def set_source(self, chunkSrc : Queue):
+    def set_source(self, chunkSrc : AudioRing):
         self.chunkSrc = chunkSrc
 
+    def set_buffer_pool(self, pool):
+        """
+        Pool that the chunks handed to feed() were borrowed from. Chunks are handed
+        back to it as soon as they have been copied into the ring.
+        """
+        self.pool = pool
+
+    def feed(self, chunk, captureTime = None):
+        """
+        Queue up samples (any number of them) to be played. Call from one thread only.
+        captureTime (time.perf_counter()) is used to trace end to end latency.
+        """
+        self.chunkSrc.write(chunk, captureTime)
+        if self.pool is not None:
+            self.pool.release(chunk)
+
+    def flush(self):
+        """
+        Drop whatever is queued up and not played yet
+        """
+        if hasattr(self.chunkSrc, "flush"):
+            self.chunkSrc.flush()
+
+    def get_stats(self):
+        """
+        Underrun / overrun counters, fill level of the jitter buffer and capture to
+        DAC latency percentiles
+        """
+        return self.chunkSrc.get_stats()
+
     def init_stream(self):
+        import sounddevice as sd # Only needed once there's a sound card to talk to (see main --no-audio)
 
         if not self.chunkSrc:
             raise RuntimeError("Invalid SpeakerManager source of data")
 
         def audio_callback(outdata, frames, time, status):
-            try:
-                data = self.chunkSrc.get_nowait()
-            except Empty:
-                outdata[:] = np.zeros((frames, 1), dtype=np.float32)
-                print("Missed a chunk")
-            else:
-                outdata[:] = data
+            # Translate when the DAC plays this buffer from the stream's clock to perf_counter's.
+            # Some host APIs don't fill in the times, then assume it plays right away.
+            dacDelay = time.outputBufferDacTime - time.currentTime if time.currentTime > 0 else 0.0
+            playTime = systime.perf_counter() + max(0.0, dacDelay)
+
+            # Ring serves however many frames the card wants and keeps count of any hiccups
+            self.chunkSrc.read(outdata[:, 0], playTime)
 
         self.stream = sd.OutputStream(
             samplerate=self.sampRate,
@@ -49,12 +81,11 @@ class SpeakerManager():
 
 import time
 def __testing():
-    q = Queue()
     bs = 2**12
     fs = 44100
 
     sm = SpeakerManager(blockSize=bs, sampRate=fs)
-    sm.set_source(q)
+    sm.set_source(AudioRing())
 
     freq = 440  # Hz
 
@@ -62,7 +93,8 @@ def __testing():
         t = np.linspace(0, bs / fs, bs, endpoint=False)
         while True:
             wave = 0.1 * np.sin(2 * np.pi * freq * t).astype(np.float32)
-            q.put(wave.reshape(-1, 1))
+            sm.feed(wave)
+            time.sleep(bs / fs)
     threading.Thread(target=generate_sine_wave, daemon=True).start()
 
     sm.init_stream()
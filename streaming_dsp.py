@@ -0,0 +1,659 @@
+"""
+Stateful DSP building blocks used by the pipeline stages.
+
+Pipeline stages only ever see the signal one chunk at a time, so anything with
+memory (filters, resamplers, ...) has to carry that memory from one chunk to the
+next. Otherwise it restarts from rest at every chunk boundary and we hear it.
+
+Blocks work in the precision of their input (see dtype_policy). Coefficients are
+designed in float64 and cast to match the input the first time a new dtype shows
+up, carried state is kept in the input's dtype.
+"""
+import numpy as np
+from enum import Enum, auto
+from math import gcd
+from numpy.lib.stride_tricks import sliding_window_view
+from scipy.signal import sosfilt, sosfilt_zi, firwin, kaiserord, lfilter
+
+def _real_dtype(dtype):
+    # float32 for complex64 / float32, float64 for complex128 / float64
+    return np.finfo(dtype).dtype
+
+class StreamingSOSFilter():
+    """
+    IIR filter made of second-order sections that keeps its state between calls.
+
+    New coefficients can be swapped in while running. Rather than restarting the
+    new filter from rest (and ringing), it is started in the steady state it would
+    have settled into had it been fed the last output of the old filter forever.
+    """
+    def __init__(self, sos):
+        self.sos     = None
+        self.zi      = None
+        self.__ziDC  = None
+        self.__lastY = 0
+        self.__dtype = np.dtype(np.float64)
+        self.__sosT  = None
+        self.set_sos(sos)
+
+    def __retype(self, dtype):
+        self.__dtype = np.dtype(dtype)
+        self.__sosT  = self.sos.astype(_real_dtype(dtype))
+        self.zi      = self.zi.astype(dtype)
+
+    def set_sos(self, sos):
+        """
+        Install new coefficients without resetting the stream
+        """
+        self.sos    = np.atleast_2d(np.asarray(sos, dtype=np.float64))
+        self.__ziDC = sosfilt_zi(self.sos)
+        self.zi     = self.__ziDC * self.__lastY
+        self.__retype(self.__dtype)
+
+    def reset(self):
+        """
+        Forget all history. Next call starts from rest.
+        """
+        self.__lastY = 0
+        self.zi      = np.zeros_like(self.__ziDC, dtype=self.__dtype)
+
+    def __call__(self, x):
+        if len(x) == 0:
+            return x
+        if x.dtype != self.__dtype:
+            self.__retype(x.dtype)
+        y, self.zi = sosfilt(self.__sosT, x, zi=self.zi)
+        self.__lastY = y[-1]
+        return y
+
+
+class PolyphaseResampler():
+    """
+    Streaming rational resampler that changes the rate by up / down.
+
+    Built as a polyphase FIR so only the taps that land on real input samples are
+    ever multiplied. Input history and the fractional position of the next output
+    sample are carried between calls, so chunk boundaries are seamless and the
+    long run output rate is exactly up / down times the input rate.
+    """
+    def __init__(self, up, down, halfLen = None):
+        g         = gcd(up, down)
+        self.up   = up // g
+        self.down = down // g
+
+        # Same prototype scipy.signal.resample_poly would use
+        if halfLen is None:
+            halfLen = 10 * max(self.up, self.down)
+        h = firwin(2 * halfLen + 1, 1 / max(self.up, self.down), window=('kaiser', 5.0)) * self.up
+
+        # bank[p, q] is the tap applied to x[n - (T-1) + q] when producing an output on phase p
+        self.tapsPerPhase = -(-len(h) // self.up)
+        h = np.concatenate([h, np.zeros(self.tapsPerPhase * self.up - len(h))])
+        self.bank = h.reshape(self.tapsPerPhase, self.up).T[:, ::-1].copy()
+        self.__bankT = self.bank
+
+        self.reset()
+
+    def reset(self):
+        """
+        Forget input history and restart phase. Next output lands on the next input.
+        """
+        self.__hist  = np.zeros(self.tapsPerPhase - 1, dtype=self.__bankT.dtype)
+        self.__phase = 0 # Position of next output, in upsampled samples, from start of next chunk
+
+    def num_outputs(self, n):
+        """
+        Number of samples the next call will produce given n input samples
+        """
+        return max(0, -(-(n * self.up - self.__phase) // self.down))
+
+    def advance(self, n):
+        """
+        Skip over n input samples as if they were all zero, without filtering
+        anything. Output count and phase stay exactly where they would have been.
+        Returns the number of (silent) outputs that were skipped.
+        """
+        nOut = self.num_outputs(n)
+        self.__phase += nOut * self.down - n * self.up
+        self.__hist[:] = 0
+        return nOut
+
+    def __call__(self, x):
+        if x.dtype != self.__hist.dtype:
+            self.__bankT = self.bank.astype(_real_dtype(x.dtype))
+            self.__hist  = self.__hist.astype(x.dtype)
+
+        nOut = self.num_outputs(len(x))
+        pos  = self.__phase + np.arange(nOut) * self.down
+        self.__phase += nOut * self.down - len(x) * self.up
+
+        buf  = np.concatenate([self.__hist, x])
+        wins = sliding_window_view(buf, self.tapsPerPhase)
+        y    = np.einsum('ij,ij->i', wins[pos // self.up], self.__bankT[pos % self.up])
+
+        self.__hist = buf[len(buf) - (self.tapsPerPhase - 1):]
+        return y
+
+
+class FIRDecimator():
+    """
+    Streaming FIR filter that only computes every factor'th output.
+
+    Taps that are zero (every other tap of a half-band filter) are skipped, so a
+    half-band stage costs about a quarter of a multiply per input sample per tap.
+    """
+    def __init__(self, taps, factor):
+        taps         = np.asarray(taps)[::-1]
+        self.factor  = factor
+        self.numTaps = len(taps)
+        self.__nz    = np.flatnonzero(np.abs(taps) > 1e-12 * np.abs(taps).max())
+        self.__taps  = taps[self.__nz].tolist() # Python floats, so they take on the input's precision
+        self.__dtype = np.dtype(np.float64)
+        self.reset()
+
+    def reset(self):
+        """
+        Forget input history and restart phase.
+        """
+        self.__hist  = np.zeros(self.numTaps - 1, dtype=self.__dtype)
+        self.__phase = 0 # Index into next chunk of the input sample the next output lines up with
+
+    def advance(self, n):
+        """
+        Skip over n input samples as if they were all zero. Returns how many
+        (silent) outputs that would have made.
+        """
+        nOut = len(range(self.__phase, n, self.factor))
+        self.__phase += nOut * self.factor - n
+        self.__hist   = np.zeros(self.numTaps - 1, dtype=self.__dtype)
+        return nOut
+
+    def __call__(self, x):
+        if x.dtype != self.__dtype:
+            self.__dtype = x.dtype
+            self.__hist  = self.__hist.astype(x.dtype)
+        nOut = len(range(self.__phase, len(x), self.factor))
+        buf  = np.concatenate([self.__hist, x])
+
+        # Window for output i covers buf[i:i + numTaps], accumulate one tap at a time over strided views
+        y = np.zeros(nOut, dtype=buf.dtype)
+        for q, tap in zip(self.__nz, self.__taps):
+            y += tap * buf[self.__phase + q : self.__phase + q + nOut * self.factor : self.factor]
+
+        self.__phase += nOut * self.factor - len(x)
+        self.__hist   = buf[len(buf) - (self.numTaps - 1):]
+        return y
+
+
+class DecimationChain():
+    """
+    Decimate by an integer factor with a cascade of half-band stages for every
+    factor of two, followed by one FIR stage for whatever odd factor is left.
+    Signal is expected to already be band limited to well under the output rate
+    (by the channel filter) so the stages only have to stop aliasing into it.
+    """
+    def __init__(self, factor, halfbandTaps = 23, tapsPerFactor = 12):
+        self.factor = factor
+        self.stages = []
+        while factor % 2 == 0:
+            self.stages.append(FIRDecimator(firwin(halfbandTaps, 0.5), 2))
+            factor //= 2
+        if factor > 1:
+            self.stages.append(FIRDecimator(firwin(tapsPerFactor * factor + 1, 0.8 / factor), factor))
+
+    def reset(self):
+        for s in self.stages:
+            s.reset()
+
+    def advance(self, n):
+        for s in self.stages:
+            n = s.advance(n)
+        return n
+
+    def __call__(self, x):
+        for s in self.stages:
+            x = s(x)
+        return x
+
+
+class FFTChannelizer():
+    """
+    Splits one wideband stream into narrow channels at arbitrary offsets (Hz from
+    the tuned frequency), each low pass filtered to bw and decimated by factor.
+
+    Works as a fast convolution (overlap-save) filter bank: every block of input is
+    transformed once, then each channel picks out the bins around its centre,
+    weights them by the channel filter's response and transforms back at the
+    decimated size. Picking, weighting and the inverse FFTs are done for all
+    channels at once as 2-D operations. Output is a (numChannels, n) array, row i
+    being channel i at fs / factor.
+
+    Centres snap to the nearest bin (fs / fftLen apart) and whatever is left over is
+    mixed out at the decimated rate. Phase runs on across blocks and chunks. Output
+    comes in whole blocks of (fftLen - overlap) / factor samples, so a call can
+    return none at all if not enough input has built up. maxStep caps the input
+    needed per block, give it the chunk size to get output from every chunk.
+
+    The channel filter is a Kaiser window design, flat out to bw / 2 and at least
+    atten dB down from stopEdge Hz off centre (bw by default, where the far side
+    of a neighbouring channel bw away starts). numTaps overrides the length.
+    """
+    def __init__(self, fs, offsets, factor, bw, numTaps = None, maxStep = None, atten = 60, stopEdge = None):
+        self.fs      = fs
+        self.offsets = np.atleast_1d(np.asarray(offsets, dtype=np.float64))
+        self.factor  = factor
+        stopEdge     = min(bw if stopEdge is None else stopEdge, fs / factor - bw / 2) # Aliases into bw past there
+        taps, beta   = kaiserord(atten, (stopEdge - bw / 2) / (fs / 2))
+        self.numTaps = numTaps if numTaps is not None else taps | 1
+        self.taps    = firwin(self.numTaps, (bw / 2 + stopEdge) / 2, window=("kaiser", beta), fs=fs)
+        numTaps      = self.numTaps
+
+        # Overlap covers the filter's memory, and is a whole number of output samples
+        self.overlap = -(-(numTaps - 1) // factor) * factor
+        self.fftLen  = max(2 * factor, 1 << int(np.ceil(np.log2(4 * self.overlap))))
+        while maxStep and self.fftLen - self.overlap > maxStep and self.fftLen > 2 * self.overlap and self.fftLen > 2 * factor:
+            self.fftLen //= 2
+        self.step    = self.fftLen - self.overlap
+        self.outLen  = self.step // factor # Outputs per block, per channel
+        self.outFs   = fs / factor
+
+        N  = self.fftLen
+        Ns = N // factor
+        k  = np.round(np.fft.fftfreq(Ns) * Ns).astype(np.int64) # Bins around a centre, in FFT order
+        self.bins     = np.round(self.offsets / fs * N).astype(np.int64)
+        self.__gather = (self.bins[:, None] + k) % N
+
+        # Each channel's filter is shifted by its left over offset so it sits right on the channel,
+        # then that offset is mixed out one output sample at a time
+        res = self.offsets - self.bins * fs / N
+        h   = self.taps * np.exp(2j * np.pi * res[:, None] * np.arange(numTaps) / fs)
+        # 1 / factor since the inverse transform normalizes by N / factor and not N
+        self.__H       = np.fft.fft(h, N, axis=-1)[:, k % N] / factor
+        self.__HT      = self.__H
+        self.__resStep = -2 * np.pi * res / self.outFs
+        self.reset()
+
+    def reset(self):
+        """
+        Forget input history. Phase carries on as if zeros had been fed in.
+        """
+        self.__hist     = np.zeros(self.overlap, dtype=self.__HT.dtype)
+        self.__s0       = -self.overlap # Input index of the start of the next block
+        self.__resPhase = np.zeros(len(self.offsets))
+
+    def __advance_phase(self, nBlocks):
+        self.__s0       += nBlocks * self.step
+        self.__resPhase  = (self.__resPhase + self.__resStep * nBlocks * self.outLen) % (2 * np.pi)
+
+    def advance(self, n):
+        """
+        Skip over n input samples as if they were all zero. Returns how many
+        (silent) outputs per channel that would have made.
+        """
+        nBlocks = (len(self.__hist) + n - self.overlap) // self.step
+        self.__advance_phase(nBlocks)
+        self.__hist = np.zeros(len(self.__hist) + n - nBlocks * self.step, dtype=self.__hist.dtype)
+        return nBlocks * self.outLen
+
+    def __call__(self, x):
+        if x.dtype != self.__hist.dtype:
+            self.__HT   = self.__H.astype(x.dtype)
+            self.__hist = self.__hist.astype(x.dtype)
+        buf     = np.concatenate([self.__hist, x])
+        nBlocks = (len(buf) - self.overlap) // self.step
+        C, N    = len(self.offsets), self.fftLen
+        if nBlocks <= 0:
+            self.__hist = buf
+            return np.zeros((C, 0), dtype=x.dtype)
+
+        blocks = sliding_window_view(buf, N)[::self.step][:nBlocks]
+        X = np.fft.fft(blocks, axis=-1)                      # (blocks, N)
+        Y = X[:, self.__gather]                              # (blocks, channels, N / factor)
+        Y *= self.__HT                                       # (channels, N / factor)
+        y = np.fft.ifft(Y, axis=-1)[..., self.overlap // self.factor:]
+
+        # Picking bins mixes by the centre relative to each block's start, turn that into one
+        # continuous phase, then mix out the rest of the offset
+        s0   = (self.__s0 + self.step * np.arange(nBlocks)) % N
+        rot  = -2 * np.pi * ((self.bins[None, :] * s0[:, None]) % N) / N
+        res  = self.__resPhase[:, None] + self.__resStep[:, None] * np.arange(nBlocks * self.outLen)
+        rot  = rot[:, :, None] + res.reshape(C, nBlocks, self.outLen).transpose(1, 0, 2)
+        y   *= np.exp(1j * rot).astype(x.dtype)
+
+        self.__advance_phase(nBlocks)
+        self.__hist = buf[nBlocks * self.step:]
+        return y.transpose(1, 0, 2).reshape(C, nBlocks * self.outLen)
+
+
+class NCO():
+    """
+    Numerically controlled oscillator that mixes a signal down by freq Hz.
+
+    Mixing multiplies by a phasor table, precomputed for the current frequency and
+    as long as the longest chunk seen so far, then by one scalar rotation for where
+    the chunk starts. So no trig runs per sample. Phase carries on across chunks
+    and across frequency changes, so retuning doesn't click.
+    """
+    def __init__(self, fs, freq = 0.0):
+        self.fs      = fs
+        self.freq    = freq
+        self.__phase = 0.0 # Cycles, at the start of the next chunk
+        self.__table = np.ones(0, dtype=np.complex64)
+
+    def set_freq(self, freq):
+        if freq != self.freq:
+            self.freq    = freq
+            self.__table = self.__table[:0]
+
+    def reset(self):
+        self.__phase = 0.0
+
+    def advance(self, n):
+        """
+        Move the phase on by n samples without mixing anything
+        """
+        self.__phase = (self.__phase + self.freq * n / self.fs) % 1.0
+
+    def __call__(self, x, out = None):
+        n = len(x)
+        if self.freq == 0:
+            return x
+        if len(self.__table) < n or self.__table.dtype != x.dtype:
+            self.__table = np.exp(-2j * np.pi * self.freq / self.fs * np.arange(max(n, len(self.__table)))).astype(x.dtype)
+
+        y = np.multiply(x, self.__table[:n], out=out)
+        y *= x.dtype.type(np.exp(-2j * np.pi * self.__phase))
+        self.advance(n)
+        return y
+
+
+class PowerEstimator(Enum):
+    RMS  = auto() # Mean power of the chunk
+    PEAK = auto() # Largest instantaneous power in the chunk
+    EWMA = auto() # Mean power smoothed across chunks
+
+
+class PowerMeter():
+    """
+    Measures power of a chunk of samples in dB. Works on |x|^2 directly so there
+    is only one log per chunk. Only every stride'th sample is looked at, which is
+    plenty for a squelch decision or a meter on the screen.
+
+    A 2-D chunk (channels, n) gets one power per row (see FFTChannelizer).
+    """
+    def __init__(self, estimator = PowerEstimator.RMS, stride = 1, alpha = 0.25):
+        self.estimator = estimator
+        self.stride    = stride
+        self.alpha     = alpha    # Weight of the newest chunk for EWMA
+        self.__avg     = None
+
+    def power(self, x):
+        """
+        Linear power of x according to the estimator
+        """
+        x = x[..., ::self.stride]
+        n = x.shape[-1]
+        if n == 0:
+            # Nothing to measure, report the running average (or silence)
+            return self.__avg if self.__avg is not None and np.shape(self.__avg) == x.shape[:-1] else np.zeros(x.shape[:-1])
+        if self.estimator == PowerEstimator.PEAK:
+            return np.abs(x).max(axis=-1) ** 2
+
+        if x.ndim == 1:
+            p = np.vdot(x, x).real / n # sum of |x|^2 without making a temporary
+        else:
+            p = (np.einsum('ij,ij->i', x.real, x.real) + np.einsum('ij,ij->i', x.imag, x.imag)) / n
+        if self.estimator == PowerEstimator.EWMA:
+            if self.__avg is None or np.shape(self.__avg) != np.shape(p):
+                self.__avg = p
+            else:
+                self.__avg = self.__avg + self.alpha * (p - self.__avg)
+            return self.__avg
+        return p
+
+    def __call__(self, x):
+        if x.ndim == 1:
+            return 10 * np.log10(max(self.power(x), 1e-20))
+        return 10 * np.log10(np.maximum(self.power(x), 1e-20))
+
+
+class FMDiscriminator():
+    """
+    Streaming FM demodulator. Output is the phase step between consecutive samples
+    scaled so +-pi maps to +-1. The last sample of each chunk is carried into the
+    next one so every input sample makes exactly one output sample, and the product
+    x[n] * conj(x[n-1]) is built in a scratch buffer that is reused between calls.
+
+    fastAtan swaps np.angle for a half-angle approximation (worst case ~0.0075 rad)
+    that needs no atan2 at all. Worth it where libm's atan2 isn't vectorized (ARM).
+
+    deemphTau is the time constant of the de-emphasis filter, None to skip it.
+
+    A 2-D input (channels, n) demodulates every row at once, each with its own
+    carried state. State starts over whenever the number of rows changes.
+    """
+    def __init__(self, fastAtan = False, deemphTau = None):
+        self.fastAtan  = fastAtan
+        self.deemphTau = deemphTau
+        self.__prod    = np.empty(0, dtype=np.complex128)
+        self.__mag     = np.empty(0)
+        self.__deemphFs = None
+        self.__deemphBA = None
+        self.reset()
+
+    def reset(self):
+        """
+        Forget the carried sample and de-emphasis state
+        """
+        self.__last = None
+        self.__zi   = None
+
+    def __fast_angle(self, y):
+        # angle(y) = 2 * atan(im / (|y| + re)) and that argument always lands in [-1, 1]
+        # where atan(z) ~= z * (pi/4 + 0.273 * (1 - |z|))
+        mag = self.__mag
+        np.abs(y, out=mag)
+        np.add(mag, y.real, out=mag)
+        np.add(mag, 1e-30, out=mag)
+        z = np.divide(y.imag, mag)
+        np.abs(z, out=mag)
+        np.subtract(1 + (np.pi / 4) / 0.273, mag, out=mag)
+        z *= mag
+        z *= 2 * 0.273
+        return z
+
+    def __deemphasize(self, y, fs):
+        if fs != self.__deemphFs or self.__deemphBA[0].dtype != y.dtype:
+            alpha = 1 - np.exp(-1 / (fs * self.deemphTau))
+            self.__deemphBA = (np.array([alpha], dtype=y.dtype), np.array([1, alpha - 1], dtype=y.dtype))
+            self.__deemphFs = fs
+        if self.__zi is None or self.__zi.dtype != y.dtype or self.__zi.shape[:-1] != y.shape[:-1]:
+            self.__zi = np.zeros(y.shape[:-1] + (1,), dtype=y.dtype)
+        y, self.__zi = lfilter(*self.__deemphBA, y, zi=self.__zi)
+        return y
+
+    def __call__(self, x, fs = None):
+        if x.shape[-1] == 0:
+            return np.zeros(x.shape, dtype=_real_dtype(x.dtype))
+        if self.__prod.shape != x.shape or self.__prod.dtype != x.dtype:
+            self.__prod = np.empty(x.shape, dtype=x.dtype)
+            self.__mag  = np.empty(x.shape, dtype=x.real.dtype)
+        if np.shape(self.__last) != x.shape[:-1]:
+            self.__last = None
+
+        prod = self.__prod
+        np.conjugate(x[..., :-1], out=prod[..., 1:])
+        prod[..., 0] = np.conj(self.__last if self.__last is not None else x[..., 0])
+        np.multiply(prod, x, out=prod)
+        self.__last = x[..., -1].copy() # Copy, x's buffer may be reused once we're done with it
+
+        y = self.__fast_angle(prod) if self.fastAtan else np.angle(prod)
+        y /= np.pi
+        if self.deemphTau and fs:
+            y = self.__deemphasize(y, fs)
+        return y
+
+
+class AGC():
+    """
+    Automatic gain control with separate attack and release times (seconds).
+
+    The signal level is tracked block by block: each block's peak pulls the level
+    up with the attack constant or lets it decay with the release constant. Gain is
+    target / level, with the level interpolated linearly between blocks so every
+    sample gets its own gain and nothing steps at block or chunk edges. The ramps
+    are built in the input's precision.
+
+    A 2-D input (channels, n) gets a level per row. The recursion then steps
+    through the blocks of every row together.
+    """
+    def __init__(self, attack = 0.005, release = 0.3, target = 1.0, blockLen = 32, floor = 1e-6):
+        self.attack   = attack
+        self.release  = release
+        self.target   = target
+        self.blockLen = blockLen
+        self.floor    = floor
+        self.reset()
+
+    def reset(self):
+        self.__level = None
+
+    def __call__(self, x, fs):
+        n = x.shape[-1]
+        if n == 0:
+            return x
+
+        starts = np.arange(0, n, self.blockLen)
+        peaks  = np.maximum.reduceat(np.abs(x), starts, axis=-1)
+        aAtk   = 1 - np.exp(-self.blockLen / (fs * self.attack))
+        aRel   = 1 - np.exp(-self.blockLen / (fs * self.release))
+        if np.shape(self.__level) != peaks.shape[:-1]:
+            self.__level = None
+
+        # Attack / release is a nonlinear recursion but it only runs once per block
+        lvl    = self.__level if self.__level is not None else (peaks[0] if x.ndim == 1 else peaks[:, 0])
+        prev   = lvl
+        levels = np.empty(peaks.shape)
+        if x.ndim == 1:
+            for i, p in enumerate(peaks.tolist()):
+                lvl += (aAtk if p > lvl else aRel) * (p - lvl)
+                levels[i] = lvl
+        else:
+            for i in range(peaks.shape[-1]):
+                p   = peaks[:, i]
+                lvl = lvl + np.where(p > lvl, aAtk, aRel) * (p - lvl)
+                levels[:, i] = lvl
+        self.__level = lvl
+
+        # Ramp from the level at the end of the previous block to the level at the end of this one
+        knots = np.concatenate((np.asarray(prev)[..., None], levels), axis=-1).astype(x.dtype)
+        L     = self.blockLen
+        ramp  = np.arange(1, L + 1, dtype=x.dtype) / L
+        level = np.empty(peaks.shape + (L,), dtype=x.dtype)
+        np.multiply(np.diff(knots)[..., None], ramp, out=level)
+        level += knots[..., :-1, None]
+        last = n - starts[-1] # Last block can be short, its ramp still has to end on its knot
+        if last != L:
+            level[..., -1, :last] = knots[..., -2, None] + (knots[..., -1, None] - knots[..., -2, None]) * (np.arange(1, last + 1, dtype=x.dtype) / last)
+        level = level.reshape(x.shape[:-1] + (-1,))[..., :n]
+
+        np.maximum(level, self.floor, out=level)
+        np.divide(self.target, level, out=level)
+        np.multiply(x, level, out=level)
+        return level
+
+
+class EnvelopeDetector():
+    """
+    AM envelope |x| with an optional DC blocker (one pole high pass at dcCutoff Hz)
+    to take the carrier back out of the audio. Works row by row on 2-D input.
+    """
+    def __init__(self, dcBlock = True, dcCutoff = 30):
+        self.dcBlock  = dcBlock
+        self.dcCutoff = dcCutoff
+        self.__fs     = None
+        self.__ba     = None
+        self.reset()
+
+    def reset(self):
+        self.__zi = None
+
+    def remove_dc(self, env, fs):
+        if fs != self.__fs or self.__ba[0].dtype != env.dtype:
+            r = np.exp(-2 * np.pi * self.dcCutoff / fs)
+            self.__ba = (np.array([1, -1], dtype=env.dtype), np.array([1, -r], dtype=env.dtype))
+            self.__fs = fs
+        if self.__zi is None or self.__zi.dtype != env.dtype or self.__zi.shape[:-1] != env.shape[:-1]:
+            self.__zi = -env[..., :1].astype(env.dtype) # Start as if the input had always been at env[0]
+        y, self.__zi = lfilter(*self.__ba, env, zi=self.__zi)
+        return y
+
+    def __call__(self, x):
+        return np.abs(x)
+
+
+def __testing():
+    from scipy.signal import butter
+
+    fs  = 0.25e6
+    n   = 2**14
+    t   = np.arange(4 * n) / fs
+    sig = np.exp(2j * np.pi * 1e3 * t)
+
+    filt  = StreamingSOSFilter(butter(5, 5e3 / (0.5 * fs), output='sos'))
+    whole = sosfilt(filt.sos, sig, zi=sosfilt_zi(filt.sos) * 0)[0]
+    parts = np.concatenate([filt(c) for c in np.split(sig, 4)])
+    print(f"Max chunked vs whole error: {np.abs(whole - parts).max()}")
+
+    # Swap to a wider filter mid stream, should not ring
+    filt.set_sos(butter(5, 20e3 / (0.5 * fs), output='sos'))
+    y = filt(sig[:n])
+    print(f"Max deviation after swap: {np.abs(np.abs(y) - 1).max()}")
+
+    # Resampled length should track the exact rate ratio no matter the chunking
+    from scipy.signal import resample_poly
+    rs    = PolyphaseResampler(44100, 250000)
+    tone  = np.sin(2 * np.pi * 1e3 * np.arange(10 * n) / fs)
+    parts = np.concatenate([rs(c) for c in np.array_split(tone, 37)])
+    ref   = resample_poly(tone, rs.up, rs.down)
+    print(f"Resampled {len(parts)} samples, expected {len(ref)}")
+    delay = 10 * max(rs.up, rs.down) // rs.down # Group delay in output samples that resample_poly compensates for
+    print(f"Max error vs resample_poly: {np.abs(parts[delay:] - ref[:len(parts) - delay]).max()}")
+    # Decimated chunks should match decimating the whole thing at once
+    from scipy.signal import upfirdn
+    dec   = FIRDecimator(firwin(23, 0.5), 2)
+    parts = np.concatenate([dec(c) for c in np.array_split(sig, 7)])
+    ref   = upfirdn(firwin(23, 0.5), sig, down=2)[:len(parts)]
+    print(f"Decimated {len(parts)} samples, max error vs upfirdn: {np.abs(parts - ref).max()}")
+
+    # Each channel should match mixing it down, filtering and decimating on its own
+    from scipy.signal import lfilter
+    offs  = [-50e3, 12345.6, 100e3]
+    chan  = FFTChannelizer(fs, offs, 4, 10e3)
+    noise = np.random.default_rng(0).standard_normal(4 * n) * (1 + 1j)
+    parts = np.concatenate([chan(c) for c in np.array_split(noise, 7)], axis=1)
+    for i, f in enumerate(offs):
+        ref = lfilter(chan.taps, 1, noise * np.exp(-2j * np.pi * f * np.arange(4 * n) / fs))[::4][:parts.shape[1]]
+        print(f"Channel at {f} Hz: {parts.shape[1]} samples, relative error vs mix + filter + decimate: {np.abs(parts[i] - ref).max() / np.abs(ref).max():.4f}")
+
+    # A tone 2 kHz into one channel should barely show up in its neighbours 12.5 and 25 kHz away
+    spacing = 12.5e3
+    chan    = FFTChannelizer(fs, [0, spacing, 2 * spacing], 4, 10e3, maxStep=n)
+    out     = np.concatenate([chan(c) for c in np.split(np.exp(2j * np.pi * 2e3 * t), 4)], axis=1)[:, chan.numTaps:]
+    dB      = 10 * np.log10(np.mean(np.abs(out) ** 2, axis=1) / np.mean(np.abs(out[0]) ** 2))
+    print(f"Adjacent channel rejection ({chan.numTaps} taps, FFT size {chan.fftLen}): "
+          f"{dB[1]:.1f} dB at {spacing / 1e3} kHz, {dB[2]:.1f} dB at {2 * spacing / 1e3} kHz, "
+          f"at least 50 dB: {bool(dB[1:].max() <= -50)}")
+
+    # Mixing in chunks, with a frequency change half way, should match one continuous oscillator
+    nco   = NCO(fs, 20e3)
+    ones  = np.ones(4 * n, dtype=np.complex64)
+    parts = [nco(c) for c in np.array_split(ones[:2 * n], 5)]
+    nco.set_freq(-30e3)
+    parts = np.concatenate(parts + [nco(c) for c in np.array_split(ones[2 * n:], 3)])
+    steps = np.concatenate([np.full(2 * n, 20e3), np.full(2 * n, -30e3)])
+    ref   = np.exp(-2j * np.pi * np.concatenate(([0], np.cumsum(steps[:-1]))) / fs)
+    print(f"NCO max phase error vs continuous oscillator: {np.abs(np.angle(parts * np.conj(ref))).max():.2e} rad")
+
+if __name__ == "__main__":
+    __testing()
@@ -4,6 +4,47 @@ See params for different param types.
 """
 
 from threading import Lock
+from types import MappingProxyType
+from param_types import Subscription
+
+class ParamSnapshot():
+    """
+    Read only view of every param's value at one moment. Never changes once made,
+    a change to any param publishes a new one with a higher version, so a reader
+    can hold on to one for as long as it likes without locking anything.
+    """
+    def __init__(self, version = 0, values = None, versions = None):
+        self.version    = version
+        self.__values   = MappingProxyType(values if values is not None else {})
+        self.__versions = MappingProxyType(versions if versions is not None else {})
+
+    def with_change(self, name, val, paramVersion):
+        """
+        Copy of this snapshot with name changed to val
+        """
+        return ParamSnapshot(self.version + 1, self.__values | {name : val}, self.__versions | {name : paramVersion})
+
+    def version_of(self, name):
+        """
+        The param's own version (see BaseParam) when this snapshot was made
+        """
+        return self.__versions[name]
+
+    def __getitem__(self, name):
+        return self.__values[name]
+
+    def __contains__(self, name):
+        return name in self.__values
+
+    def get(self, name, default = None):
+        return self.__values.get(name, default)
+
+    def items(self):
+        return self.__values.items()
+
+    def __repr__(self):
+        return f"ParamSnapshot(v{self.version}, {dict(self.__values)})"
+
 class SysParams():
     """
     Bundles system params and provides a single, threadsafe location in which
@@ -25,6 +66,10 @@ class SysParams():
 
     def __init__(self):
         self.__params = {}
+        self.__mirrors = []
+        self.__snapshot = ParamSnapshot()
+        self.__snapLock = Lock() # Only taken by writers publishing a new snapshot
+        self.__subs = []         # (names watched or None for all of them, Subscription)
 
     def register_new_param(self, paramKind, name, initialValue, *args):
         """
@@ -34,6 +79,71 @@ class SysParams():
             print(f"System parameter '{name}' already exists. Overwriting.")
         print(f"[System Params] > Registering parameter under key {name}")
         self.__params[name] = paramKind(initialValue, *args)
+        self.__params[name].setHooks.append(lambda val, name=name: self.__publish(name, val))
+        self.__params[name].changeHooks.append(lambda param, name=name: self.__republish(name, param))
+        self.__republish(name, self.__params[name], force=True)
+
+    def __publish(self, name, val):
+        for q in self.__mirrors:
+            q.put((name, val))
+
+    def __republish(self, name, param, force = False):
+        # Copy on write: readers keep using the old snapshot while the new one is made,
+        # then swapping the reference over is atomic.
+        with self.__snapLock:
+            snap = self.__snapshot
+            val, version = param.get_versioned()
+            if not force and name in snap and snap.version_of(name) >= version:
+                return # A later change beat us here and already published this one's value
+            self.__snapshot = snap.with_change(name, val, version)
+        for names, sub in self.__subs:
+            if names is None or name in names:
+                sub.notify(name)
+
+    def subscribe(self, names, fx, notifier = None, interval = 0.25):
+        """
+        Call fx(snapshot, changed) on notifier (a shared thread by default) after
+        any of the params in names (None for all) change. changed lists the names
+        that did. Calls come at most once every interval seconds with everything
+        that changed since the last, see param_types.Subscription. Returns the
+        Subscription, cancel() it to stop.
+        """
+        sub = Subscription(lambda changed : fx(self.snapshot(), changed), notifier, interval)
+        self.__subs.append((None if names is None else frozenset(names), sub))
+        return sub
+
+    def snapshot(self):
+        """
+        The current values of every param as a ParamSnapshot. Doesn't lock. Its
+        version only ever goes up, so it's cheap to tell if anything changed since
+        the last one.
+        """
+        return self.__snapshot
+
+    @property
+    def version(self):
+        return self.__snapshot.version
+
+    def add_mirror(self, queue):
+        """
+        Forward every future set() as a (name, value) pair onto queue. Used to keep
+        the copy of the params in a forked process up to date, see apply_mirrored.
+        Note that objects changed in place (not through set) are not forwarded.
+        """
+        self.__mirrors.append(queue)
+
+    def apply_mirrored(self, queue):
+        """
+        Meant for the child side of a fork: stop forwarding (the parent does that) and
+        apply updates from queue until None shows up. Blocks, so run it on a thread.
+        Subscribers are dropped here too, the parent runs them and mirrors over
+        whatever they set.
+        """
+        self.__mirrors = []
+        self.__subs = []
+        while (update := queue.get()) is not None:
+            name, val = update
+            self.__params[name].set(val)
 
     def __getitem__(self, key):
         return self.__params[key]
@@ -44,7 +154,7 @@ def __testing():
     ps = SysParams()
 
     ps.register_new_param(BaseParam, "Foo", True)
-    ps.register_new_param(NumericParam, "Bar", 0, -1, 10, 1)
+    ps.register_new_param(NumericParam, "Bar", 0, -1, 10, [1])
     ps.register_new_param(BaseParam, "Foo", 1) # Testing overwrite here... Should get warning
     
     print(f"{ps['Foo'].get() = }")
@@ -60,6 +170,29 @@ def __testing():
     print(f"{ps['Bar'].get() = }")
     ps["Bar"].step(NumericParam.StepDir.DOWN)
     print(f"{ps['Bar'].get() = }")
+
+    snap = ps.snapshot()
+    ps["Foo"].set(4)
+    print(f"{snap['Foo'] = } (v{snap.version}), {ps.snapshot()['Foo'] = } (v{ps.version})")
+
+    import threading
+    done = threading.Event()
+    ps.subscribe(["Bar"], lambda snap, changed : (print(f"{changed} changed, Bar is now {snap['Bar']}"), done.set()))
+    for _ in range(5):
+        ps["Bar"].step(NumericParam.StepDir.UP)
+    ps["Foo"].set(5) # Not watched
+    done.wait(1)
+
+    # Writers racing each other, whatever was set last should be what's published
+    def hammer(k):
+        for i in range(2000):
+            ps["Foo"].set((k, i))
+    writers = [threading.Thread(target=hammer, args=(k,)) for k in range(4)]
+    for w in writers:
+        w.start()
+    for w in writers:
+        w.join()
+    print(f"Published {ps.snapshot()['Foo']} (v{ps.snapshot().version_of('Foo')}), param holds {ps['Foo'].get_versioned()}")
     
 if __name__ == "__main__":
     __testing()
\ No newline at end of file
@@ -6,16 +6,30 @@ All stages are assuming that data looks like a PipelineDatPackage object
 """
 
 import asyncio
-from pc_model import pc_runner, BaseConsumer, BaseProducer, FxApplyWindow, FxApplyWorker, AbstractWorker, AbstractWindow
+import time
+from pc_model import pc_runner, BaseConsumer, BaseProducer, FxApplyWindow, FxApplyWorker, AbstractWorker, AbstractWindow, DropPolicy
 import numpy as np
+from buffer_pool import BufferPool
+from iq_files import cu8_to_complex, cu8_lut_is_faster
 
 class PipelineDataPackage():
     """
     Bundle of data and metadata to be sent down pipeline
     """
-    def __init__(self, data = None, meta = {}):
+    def __init__(self, data = None, meta = None):
         self.data = data
-        self.meta = meta
+        self.meta = meta if meta is not None else {}
+
+    @property
+    def captureTime(self):
+        # time.perf_counter() when the samples came off the dongle. Used for latency tracing.
+        return self.meta.get("t_capture")
+
+    def __len__(self):
+        # Number of samples (per channel), squelched packets included. Used by pipeline metrics.
+        if self.data is None:
+            return self.meta.get("num_samples", 0)
+        return self.data.shape[-1]
 
 class DemodulateRF(AbstractWindow):
     """
@@ -24,55 +38,366 @@ class DemodulateRF(AbstractWindow):
     def __init__(self, dmgr):
         super().__init__()
         self.dmgr = dmgr
+        self.__version = None
+        self.__name = None
 
     def inspect(self, pdp):
         if not pdp.meta["squelched"]:
             pdp.data = self.dmgr(pdp.data, **pdp.meta)
+        else:
+            self.dmgr.get().reset()
 
-        pdp.meta["demod_name"] = self.dmgr.get().get_demod_scheme_name() # So much for being agnostic of whats in here
+        # Only changes when the scheme is cycled, which touches the param
+        if self.dmgr.version != self.__version:
+            self.__name = self.dmgr.get().get_demod_scheme_name() # So much for being agnostic of whats in here
+            self.__version = self.dmgr.version
+        pdp.meta["demod_name"] = self.__name
 
 class Endpoint(BaseConsumer):
     """
     Black hole that eats objects from previous node's queue. Prevents last queue from growing w/o bound
     """
     async def consume(self):
-        await self.source.get_result()
+        while await self.pull() is not None:
+            pass
 
-from scipy.signal import resample
+from fractions import Fraction
+from streaming_dsp import PolyphaseResampler
 class Downsample(AbstractWorker):
     """
-    Downsample from radio sample rate to rate that works for audio playback
+    Downsample from radio sample rate to rate that works for audio playback.
+    Uses a streaming polyphase resampler so chunk edges line up and the number of
+    samples produced over time matches the rate ratio exactly.
     """
     def __init__(self, fromRate, toRate):
         super().__init__()
         self.fromRate = fromRate
         self.toRate = toRate
+        self.__key = None
+        self.__rates = None
+        self.__resampler = None
 
     def process(self, pdp):
-        data = pdp.data
-        pdp.data = resample(data, int(len(data) * self.toRate / self.fromRate))
+        # Keyed on param versions so the rates are only read (and compared) when one changed
+        key = (pdp.meta.get("fs"), self.fromRate.version, self.toRate.version)
+        if key != self.__key:
+            rates = (pdp.meta.get("fs", self.fromRate.get()), self.toRate.get())
+            if rates != self.__rates:
+                ratio = (Fraction(rates[1]) / Fraction(rates[0])).limit_denominator(10000)
+                self.__resampler = PolyphaseResampler(ratio.numerator, ratio.denominator)
+                self.__rates = rates
+            self.__key = key
+
+        # Squelched packets have no samples, just keep count of how many there would be
+        if pdp.meta["squelched"]:
+            pdp.meta["num_samples"] = self.__resampler.advance(pdp.meta["num_samples"])
+        else:
+            pdp.data = self.__resampler(pdp.data)
         return pdp
 
 
-from scipy.signal import lfilter
+from streaming_dsp import DecimationChain
+class Decimate(AbstractWorker):
+    """
+    Bring the (already channel filtered) signal down to a small multiple of the
+    channel bandwidth so demodulation and resampling run on far fewer samples.
+    The resulting sample rate is stamped onto pdp.meta["fs"] for later stages.
+    """
+    def __init__(self, fs, bw, oversample = 4):
+        super().__init__()
+        self.fs = fs
+        self.bw = bw
+        self.oversample = oversample
+        self.__version = None
+        self.__cfg = None
+        self.__chain = None
+
+    def process(self, pdp):
+        version = (self.fs.version, self.bw.version)
+        if version != self.__version:
+            cfg = (self.fs.get(), self.bw.get())
+            factor = max(1, int(cfg[0] // (self.oversample * cfg[1])))
+            # Most bandwidth steps land on the same factor, keep the chain (and its filter state) then
+            rebuild = self.__chain is None or factor != self.__chain.factor
+            if rebuild:
+                self.__chain = DecimationChain(factor)
+            if rebuild or cfg[0] != self.__cfg[0]:
+                print(f"[Decimate] > Decimating by {factor} to {cfg[0] / factor} Hz")
+            self.__cfg = cfg
+            self.__version = version
+        if pdp.meta.get("squelched", False):
+            pdp.meta["num_samples"] = self.__chain.advance(pdp.meta["num_samples"])
+        else:
+            pdp.data = self.__chain(pdp.data)
+        pdp.meta["fs"] = self.__cfg[0] / self.__chain.factor
+        return pdp
+
+
+from streaming_dsp import NCO
+class FineTune(AbstractWorker):
+    """
+    Mixes each chunk down by its meta["nco_offset"] (Hz, stamped by StampGeneration)
+    so the frequency being listened to ends up at 0 Hz, for tuning around within
+    the captured band without retuning the dongle. Goes ahead of Filter. Phase
+    runs on across chunks and offset changes (see streaming_dsp.NCO).
+    """
+    def __init__(self, fs):
+        super().__init__()
+        self.fs = fs
+        self.__nco = None
+
+    def process(self, pdp):
+        fs = float(self.fs)
+        if self.__nco is None or self.__nco.fs != fs:
+            self.__nco = NCO(fs)
+        self.__nco.set_freq(pdp.meta.get("nco_offset", 0.0))
+
+        if pdp.meta.get("squelched", False):
+            self.__nco.advance(pdp.meta["num_samples"])
+        else:
+            # Mix in place when we're allowed to, chunks from a replayed file are read only
+            pdp.data = self.__nco(pdp.data, pdp.data if pdp.data.flags.writeable else None)
+        return pdp
+
+from streaming_dsp import StreamingSOSFilter
 class Filter(AbstractWorker):
     """
-    Apply a filter from numerator and denominator coefficients
+    Apply an IIR filter given as second-order sections. Filter state is carried
+    from chunk to chunk and new coefficients set on the sos param are picked up
+    on the next chunk without restarting the filter.
     """
-    def __init__(self, b, a):
+    def __init__(self, sos):
         super().__init__()
-        self.b = b
-        self.a = a
+        self.sos         = sos
+        self.__version   = sos.version
+        self.__activeSos = sos.get()
+        self.__filt      = StreamingSOSFilter(self.__activeSos)
 
     def process(self, pdp):
-        pdp.data = lfilter(self.b, self.a, pdp.data)
+        if self.sos.version != self.__version:
+            self.__version = self.sos.version
+            sos = self.sos.get()
+            if sos is not self.__activeSos:
+                self.__filt.set_sos(sos)
+                self.__activeSos = sos
+
+        # Nothing to filter while squelched. Start from rest when it opens back up.
+        if pdp.meta.get("squelched", False):
+            self.__filt.reset()
+        else:
+            pdp.data = self.__filt(pdp.data)
         return pdp
 
+from streaming_dsp import FFTChannelizer
+class Channelize(AbstractWorker):
+    """
+    Splits the wideband capture into narrow channels so several can be monitored
+    at once, in place of Filter / Decimate. channels is a param holding a list of
+    (frequency in Hz, priority) pairs, channels that don't fit in the capture
+    are left out. Every channel is filtered to bw and decimated to a small
+    multiple of it, see FFTChannelizer.
+
+    The capture is around where the dongle is tuned, meta["hw_cf"], and FineTune
+    has already moved its centre to meta["hw_cf"] + meta["nco_offset"] (see
+    StampGeneration). Packets without those are taken to be centred on cf.
+
+    Packets come out with data of shape (channels, n). Later stages that support
+    it (MeasurePower, ApplySquelch, DemodulateRF) work on all channels at once
+    until MixChannels picks the one to listen to. meta["channels"] and
+    meta["priorities"] describe the rows and meta["fs"] is the channel rate.
+    Should see every sample, so put it before any squelch.
+    """
+    def __init__(self, channels, cf, fs, bw, oversample = 4):
+        super().__init__()
+        self.channels = channels
+        self.cf = cf
+        self.fs = fs
+        self.bw = bw
+        self.oversample = oversample
+        self.__version = None
+        self.__cfg = None
+        self.__chan = None
+        self.__freqs = ()
+        self.__prios = ()
+
+    def __configure(self, cfg, chunkLen):
+        channels, hwCf, cf, fs, bw = cfg
+        inBand = [(f, p) for f, p in channels if abs(f - hwCf) + bw / 2 < fs / 2]
+        for f, _ in set(channels) - set(inBand):
+            print(f"[Channelize] > {f / 1e6:.4f} MHz is outside the capture around {hwCf / 1e6:.4f} MHz, skipping it")
+        self.__freqs = tuple(f for f, _ in inBand)
+        self.__prios = tuple(p for _, p in inBand)
+
+        # Power of two so blocks split evenly into output samples
+        factor = 1 << max(0, int(np.log2(fs / (self.oversample * bw))))
+        self.__chan = FFTChannelizer(fs, [f - cf for f in self.__freqs], factor, bw, maxStep=chunkLen)
+        self.__cfg = cfg
+        print(f"[Channelize] > {len(self.__freqs)} channels at {fs / factor} Hz, FFT size {self.__chan.fftLen}")
+
+    def process(self, pdp):
+        hwCf, offset = pdp.meta.get("hw_cf"), pdp.meta.get("nco_offset", 0.0)
+        version = (self.channels.version, self.cf.version, self.fs.version, self.bw.version, hwCf, offset)
+        if version != self.__version:
+            cf = self.cf.get() if hwCf is None else hwCf + offset
+            cfg = (tuple(self.channels.get()), cf if hwCf is None else hwCf, cf, self.fs.get(), self.bw.get())
+            if cfg != self.__cfg:
+                self.__configure(cfg, len(pdp))
+            self.__version = version
+
+        if pdp.meta.get("squelched", False):
+            pdp.meta["num_samples"] = self.__chan.advance(pdp.meta["num_samples"])
+        else:
+            pdp.data = self.__chan(pdp.data)
+        pdp.meta["fs"] = self.__chan.outFs
+        pdp.meta["channels"] = self.__freqs
+        pdp.meta["priorities"] = self.__prios
+        return pdp
+
+class MixChannels(AbstractWorker):
+    """
+    Picks which channel of a channelized packet gets heard: the open channel with
+    the highest priority (the loudest one among equals). A channel that's playing
+    keeps playing until its squelch closes or a channel with a strictly higher
+    priority opens, so equal channels don't take turns mid transmission.
+
+    Goes after DemodulateRF. Packets come out like the single channel pipeline's
+    with meta["channel"] set to the frequency that was picked (None if squelched),
+    meta["dB"] to its power and every channel's power kept in meta["ch_dB"].
+    """
+    def __init__(self):
+        super().__init__()
+        self.current = None # Frequency of the channel being listened to
+
+    def __pick(self, freqs, isOpen, prios, dB):
+        candidates = np.flatnonzero(isOpen).tolist()
+        best = max(candidates, key=lambda i: (prios[i], dB[i]))
+        cur = freqs.index(self.current) if self.current in freqs else None
+        if cur in candidates and prios[best] <= prios[cur]:
+            return cur
+        return best
+
+    def process(self, pdp):
+        freqs = pdp.meta["channels"]
+        dB = pdp.meta["dB"]
+        pdp.meta["ch_dB"] = dB
+        if pdp.meta["squelched"]:
+            self.current = None
+            pdp.meta["channel"] = None
+            pdp.meta["dB"] = float(dB.max()) if len(dB) else -200.0
+            return pdp
+
+        pick = self.__pick(freqs, pdp.meta["ch_open"], pdp.meta["priorities"], dB)
+        if freqs[pick] != self.current:
+            print(f"[MixChannels] > Listening to {freqs[pick] / 1e6:.4f} MHz")
+            self.current = freqs[pick]
+        pdp.data = pdp.data[pick]
+        pdp.meta["channel"] = freqs[pick]
+        pdp.meta["dB"] = float(dB[pick])
+        return pdp
+
+class StampTuning(AbstractWindow):
+    """
+    Goes after StampGeneration when scanning (see scanner). Stamps each chunk with
+    the frequency it was captured at (meta["cf"]) and whether the dongle held
+    still for all of it (meta["tune_settled"], see RetuneScheduler.is_settled),
+    tells the scanner once chunks from where it asked to be show up, then lets it
+    run its timers, which may ask for a retune for the chunks to come.
+    """
+    def __init__(self, scanner, retuner, fs):
+        super().__init__()
+        self.scanner = scanner
+        self.retuner = retuner
+        self.fs = fs
+
+    def inspect(self, pdp):
+        t1 = pdp.captureTime if pdp.captureTime is not None else time.perf_counter()
+        t0 = t1 - len(pdp) / float(self.fs)
+        hwCf = pdp.meta.get("hw_cf")
+        settled = hwCf is not None and self.retuner.is_settled(t0, t1)
+        if hwCf is not None:
+            pdp.meta["cf"] = hwCf + pdp.meta.get("nco_offset", 0.0)
+            if settled:
+                self.scanner.tuned(pdp.meta["cf"], t0)
+        pdp.meta["tune_settled"] = settled
+        self.scanner.tick(t1)
+
+class ReportSquelch(AbstractWindow):
+    """
+    Goes after ApplySquelch when scanning. Chunks captured while the tuner was
+    still settling are squelched so nobody hears them, the squelch decision on
+    every other chunk is passed on to the scanner.
+    """
+    def __init__(self, scanner):
+        super().__init__()
+        self.scanner = scanner
+
+    def inspect(self, pdp):
+        if not pdp.meta.get("tune_settled", True):
+            if not pdp.meta["squelched"]:
+                pdp.meta["num_samples"] = len(pdp)
+                pdp.data = None
+                pdp.meta["squelched"] = True
+            return
+        t1 = pdp.captureTime if pdp.captureTime is not None else time.perf_counter()
+        self.scanner.report(pdp.meta["cf"], t1, not pdp.meta["squelched"])
+
+class StampGeneration(AbstractWindow):
+    """
+    Goes right after the source. Stamps each chunk with the retune generation in
+    force when its first sample was captured (meta["gen"], see retune) so chunks
+    from before a retune can be told apart from the rest further down, with
+    how far off the dongle's frequency we're listening (meta["nco_offset"], for
+    FineTune) and with where the dongle was tuned (meta["hw_cf"], what the raw
+    samples are centred on).
+    """
+    def __init__(self, retuner, fs):
+        super().__init__()
+        self.retuner = retuner
+        self.fs = fs
+
+    def inspect(self, pdp):
+        t1 = pdp.captureTime if pdp.captureTime is not None else time.perf_counter()
+        pdp.meta["gen"], pdp.meta["nco_offset"], pdp.meta["hw_cf"] = self.retuner.tuning_at(t1 - len(pdp) / float(self.fs))
+
+class DropStale(BaseProducer, BaseConsumer):
+    """
+    Throws away chunks stamped (by StampGeneration) with a generation older than
+    the retuner's current one, so the new frequency is heard as soon as possible.
+    Can go at several points in the pipeline: early on it saves the work, just
+    before the speakers it catches whatever was already past the early ones.
+
+    onDrop(pdp) is called for each dropped chunk (to give back pooled buffers).
+    With markHeard the retuner is told when each new generation got through.
+    """
+    def __init__(self, retuner, onDrop = None, markHeard = False):
+        super().__init__()
+        self.retuner = retuner
+        self.onDrop = onDrop
+        self.markHeard = markHeard
+        self.numDropped = 0
+
+    async def consume(self):
+        return await self.pull()
+
+    async def produce(self):
+        while (pdp := await self.consume()) is not None:
+            gen = pdp.meta.get("gen")
+            if self.retuner.is_stale(gen):
+                self.numDropped += 1
+                if self.onDrop is not None:
+                    self.onDrop(pdp)
+                continue
+            if self.markHeard:
+                self.retuner.mark_heard(gen)
+            await self.outbox.put(pdp)
+        await self.stop()
+
 from threading import Thread
 from queue import Queue
 class DEBUG_SAVE_TO_FILE(AbstractWindow):
     """
-    Saves the signal to a file
+    Saves the signal to a file as complex64 whatever the dtype policy, so .iq
+    files always replay as cf32 (see iq_files)
     """
 
     def fWrite_worker(self):
@@ -89,39 +414,200 @@ class DEBUG_SAVE_TO_FILE(AbstractWindow):
         print("inited")
 
     def inspect(self, data):
-        self.__q.put(data.data)
+        if data.data is not None:
+            self.__q.put(data.data.astype(np.complex64))
  
     async def stop(self):
         self.__fhandle.close()
         await super().stop()
 
-import time
+from recorder import SigMFRecording, RecordingWriter
+class Record(AbstractWindow):
+    """
+    Records whatever passes through to rotating SigMF files (see recorder). Disk
+    writes happen in large batches on a thread of their own and never hold up the
+    pipeline, if the disk can't keep up samples are dropped and counted instead.
+
+    cf and gain (params, getters, plain values or None) are read for every chunk
+    and written to the metadata, a new capture segment (and for gain an
+    annotation) starts whenever either changes. cf is where the dongle
+    is tuned, which is what raw samples are centred on. Unless cf is None (not
+    known, e.g. replaying) a packet's meta["hw_cf"] (see StampGeneration) takes
+    precedence, since digital retunes move sdr_cf but leave the dongle alone.
+
+    Placed after ApplySquelch only what gets past the squelch is recorded, each
+    burst as its own capture segment. Placed before it everything is recorded.
+    """
+    def __init__(self, prefix, fs, cf = None, gain = None, maxBytes = 2**30, maxSeconds = 3600, batchBytes = 2**22, numBatches = 4):
+        super().__init__()
+        self.prefix = prefix
+        self.fs = fs
+        self.cf = cf
+        self.gain = gain
+        self.maxBytes = maxBytes
+        self.maxSeconds = maxSeconds
+        self.batchBytes = batchBytes
+        self.numBatches = numBatches
+        self.writer = None
+
+    @staticmethod
+    def __value(v):
+        if hasattr(v, "get"):
+            return v.get()
+        return v() if callable(v) else v
+
+    def inspect(self, pdp):
+        if pdp.data is None:
+            # Squelched, nothing to record. Whatever comes next is a new burst.
+            if self.writer is not None:
+                self.writer.mark_gap()
+            return
+
+        if self.writer is None:
+            # Sample type and rate are only known for sure once data shows up
+            fs = pdp.meta.get("fs", self.__value(self.fs))
+            rec = SigMFRecording(self.prefix, fs, pdp.data.dtype, self.maxBytes, self.maxSeconds)
+            self.writer = RecordingWriter(rec, self.batchBytes, self.numBatches)
+            print(f"[Record] > Recording {pdp.data.dtype} at {fs} Hz to {self.prefix}_*")
+        cf = self.__value(self.cf)
+        if cf is not None:
+            cf = pdp.meta.get("hw_cf", cf)
+        self.writer.append(pdp.data, cf, self.__value(self.gain))
+
+    async def stop(self):
+        if self.writer is not None:
+            # Wait for the last batch to hit the disk without blocking the event loop
+            await asyncio.get_running_loop().run_in_executor(None, self.writer.close)
+            if self.writer.numDropped:
+                print(f"[Record] > {self.writer.numDropped} samples dropped, disk could not keep up")
+        await super().stop()
+
+from dtype_policy import get_policy
 class ProvideRawRF(BaseProducer):
-    def __init__(self, sdr, spb, stopSig):
+    """
+    Streams from the dongle. With rawBytes the interleaved uint8 I/Q the dongle
+    produces is converted to complex64 (see iq_files.cu8_to_complex) straight
+    into recycled buffers, instead of pyrtlsdr building a fresh complex128 array
+    for every chunk. lut picks how (see cu8_to_complex), by default whichever is
+    quicker on this CPU, timed here so the first chunk doesn't wait on it.
+
+    This is where samples enter the pipeline, so it's one of the places that
+    converts to the dtype policy (see dtype_policy).
+    """
+    def __init__(self, sdr, spb, stopSig, rawBytes = True, lut = None):
         super().__init__()
         self.sdr = sdr
-        self.sampleStream = self.sdr.stream(num_samples_or_bytes=spb, format='samples')
+        self.spb = int(spb)
+        self.rawBytes = rawBytes
+        self.lut = cu8_lut_is_faster() if lut is None and rawBytes else lut
+        self.policy = get_policy()
+        if rawBytes:
+            self.sampleStream = self.sdr.stream(num_samples_or_bytes=2 * self.spb, format='bytes')
+            self.pool = BufferPool((self.spb,), np.complex64, autoReclaim=True)
+        else:
+            self.sampleStream = self.sdr.stream(num_samples_or_bytes=self.spb, format='samples')
         self.stopSig = stopSig
 
+    def __convert(self, chunk):
+        raw = np.frombuffer(chunk, dtype=np.uint8)
+        out = self.pool.acquire()
+        return cu8_to_complex(raw, out[:len(raw) // 2], self.lut)
+
     async def produce(self):
         async for chunk in self.sampleStream:
             if self.stopSig.is_set():
                 break
             pdp = PipelineDataPackage()
-            pdp.data = chunk
+            pdp.data = self.policy.to_complex(self.__convert(chunk) if self.rawBytes else chunk)
             pdp.meta["timestamp"] = time.time()
-            print(pdp.data.dtype)
+            pdp.meta["t_capture"] = time.perf_counter()
             await self.outbox.put(pdp)
         await self.sdr.stop()
         self.sdr.close()
         await self.stop()
 
+from iq_files import open_iq_file, num_samples
+class ReplayRF(BaseProducer):
+    """
+    Stand in for ProvideRawRF that plays back an IQ capture file (see iq_files).
+    The file is memory mapped and complex formats are sent as views straight into
+    it, nothing is read until a stage touches the samples. cu8 has to be converted
+    so those chunks are fresh arrays.
+
+    realtime paces chunks to fs like a dongle would, otherwise chunks go out as fast
+    as the pipeline takes them. loop starts over at the end of the file.
+
+    Samples are converted to the dtype policy on the way out, so a file that isn't
+    already in the policy's precision is copied after all.
+    """
+    def __init__(self, path, spb, stopSig, fs, fmt = None, realtime = True, loop = False):
+        super().__init__()
+        self.path = path
+        self.spb = int(spb)
+        self.stopSig = stopSig
+        self.fs = float(fs)
+        self.realtime = realtime
+        self.loop = loop
+        self.policy = get_policy()
+        self.fmt, self.__mm = open_iq_file(path, fmt)
+        self.numSamples = num_samples(self.fmt, self.__mm)
+        print(f"[ReplayRF] > {path}: {self.numSamples} {self.fmt} samples ({self.numSamples / self.fs:.1f} s)")
+
+    def __chunk(self, start, end):
+        if self.fmt == "cu8":
+            return cu8_to_complex(self.__mm[2 * start:2 * end])
+        return self.__mm[start:end]
+
+    def __chunks(self):
+        while True:
+            for start in range(0, self.numSamples, self.spb):
+                yield self.__chunk(start, min(start + self.spb, self.numSamples))
+            if not self.loop or not self.numSamples:
+                return
+
+    async def produce(self):
+        t0 = time.perf_counter()
+        sent = 0
+        for chunk in self.__chunks():
+            if self.stopSig.is_set():
+                break
+            sent += len(chunk)
+            if self.realtime:
+                # A chunk is "captured" once its last sample would have come off the dongle
+                await asyncio.sleep(max(0, t0 + sent / self.fs - time.perf_counter()))
+            pdp = PipelineDataPackage()
+            pdp.data = self.policy.to_complex(chunk)
+            pdp.meta["timestamp"] = time.time()
+            pdp.meta["t_capture"] = time.perf_counter()
+            await self.outbox.put(pdp)
+        await self.stop()
+
 class RechunkArray(BaseProducer, BaseConsumer):
-    def __init__(self, tarBlockSize):
+    """
+    Regroups incoming samples into blocks of exactly tarBlockSize samples.
+    Samples are written straight into blocks borrowed from a BufferPool and the
+    block itself is sent on, so every sample is copied (and cast to dtype) once.
+    Whoever ends up with the block should hand it back with pool.release().
+
+    Squelched packets carry no samples, only a count. Those turn into the same
+    preallocated (read only) block of silence each time.
+
+    A block's capture time (meta["t_capture"]) is that of the packet its first
+    sample came from, so latency is measured for the oldest sample in the block.
+
+    Samples leave the pipeline here, so this is where they're converted to what
+    the sound card takes (dtype), whatever the dtype policy.
+    """
+    def __init__(self, tarBlockSize, dtype = np.float32, pool = None):
         super().__init__()
-        self.tarBlockSize = tarBlockSize
-        self.partial = np.full(shape = (tarBlockSize,), fill_value=0.0, dtype=np.float32)
+        self.tarBlockSize = int(tarBlockSize)
+        self.pool = pool if pool is not None else BufferPool((self.tarBlockSize,), dtype)
+        self.partial = self.pool.acquire()
         self.partialLen = 0
+        self.partialMeta = None
+        self.partialT0 = None
+        self.silence = np.zeros(self.tarBlockSize, dtype=dtype)
+        self.silence.flags.writeable = False
         self.isRunning = True
 
     # Weird produce / consume usage here. TODO Change to use AbstractWorker for clarity
@@ -130,17 +616,37 @@ class RechunkArray(BaseProducer, BaseConsumer):
             await self.consume()
 
     async def consume(self):
-        pdp = await self.source.get_result()
+        pdp = await self.pull()
         if pdp is None:
             await self.outbox.put(None)
             self.isRunning = False
             return
+        if pdp.meta["squelched"]:
+            await self.__push_silence(pdp)
+        else:
+            await self.__push_samples(pdp)
+
+    def __start_partial(self, meta):
+        if self.partialLen == 0:
+            self.partialT0 = meta.get("t_capture")
+
+    async def __send_partial(self):
+        # Block now belongs to whoever is downstream. Several blocks can share a packet's meta, so copy it.
+        meta = dict(self.partialMeta)
+        meta["t_capture"] = self.partialT0
+        await self.outbox.put(PipelineDataPackage(data = self.partial, meta = meta))
+        self.partial = self.pool.acquire()
+        self.partialLen = 0
+
+    async def __push_samples(self, pdp):
         data = pdp.data
         dataPos = 0
+        self.partialMeta = pdp.meta
             
         while dataPos < len(data): # More data available from last time we got data
 
             # Move samples into buffer
+            self.__start_partial(pdp.meta)
             amtToMove = min(self.tarBlockSize - self.partialLen, len(data) - dataPos)
             self.partial[self.partialLen:self.partialLen + amtToMove] = data[dataPos: dataPos + amtToMove]                
             self.partialLen += amtToMove
@@ -148,8 +654,29 @@ class RechunkArray(BaseProducer, BaseConsumer):
             
             # Send when we have enough
             if self.partialLen == self.tarBlockSize:
-                await self.outbox.put(PipelineDataPackage(data = self.partial.copy(), meta = pdp.meta))
-                self.partialLen = 0
+                await self.__send_partial()
+
+    async def __push_silence(self, pdp):
+        remaining = pdp.meta["num_samples"]
+
+        # Finish off a block that still has audio in it from before the squelch closed
+        if self.partialLen:
+            amtToMove = min(self.tarBlockSize - self.partialLen, remaining)
+            self.partial[self.partialLen:self.partialLen + amtToMove] = 0
+            self.partialLen += amtToMove
+            remaining -= amtToMove
+            if self.partialLen == self.tarBlockSize:
+                await self.__send_partial()
+
+        while remaining >= self.tarBlockSize:
+            await self.outbox.put(PipelineDataPackage(data = self.silence, meta = pdp.meta))
+            remaining -= self.tarBlockSize
+
+        if remaining:
+            self.__start_partial(pdp.meta)
+            self.partial[:remaining] = 0
+            self.partialLen = remaining
+            self.partialMeta = pdp.meta
 
 class ReshapeArray(AbstractWorker):
     def __init__(self, newShape):
@@ -167,20 +694,125 @@ class AdjustVolume(AbstractWindow):
 
     def inspect(self, pdp):
         if not pdp.meta["squelched"]:
-            pdp.data = pdp.data * self.__vol / 100 * pdp.data.max()
+            np.multiply(pdp.data, float(self.__vol) / 100 * pdp.data.max(), out=pdp.data)
+
+from streaming_dsp import PowerMeter, PowerEstimator
+class MeasurePower(AbstractWindow):
+    """
+    Puts the power of each chunk in dB on pdp.meta["dB"] for the squelch and screen.
+    Goes before ApplySquelch. Placed after Filter / Decimate it measures in-channel
+    power instead of power across the whole capture. After Channelize it's an
+    array with one dB per channel.
+    """
+    def __init__(self, estimator = PowerEstimator.RMS, stride = 1, alpha = 0.25):
+        super().__init__()
+        self.meter = PowerMeter(estimator, stride, alpha)
 
-class CalcDecibels(AbstractWindow):
     def inspect(self, pdp):
-        pdp.meta["dB"] = np.mean(20 * np.log10(np.abs(pdp.data)))
+        pdp.meta["dB"] = self.meter(pdp.data)
 
 class ApplySquelch(AbstractWindow):
+    """
+    Squelches packets whose meta["dB"] is at or under the squelch level.
+    Channelized packets (see Channelize) have a dB per channel: meta["ch_open"]
+    says which channels are open and the packet is only squelched if none are.
+    """
     def __init__(self, squelch):
         super().__init__()
         self.__squelch = squelch
     
     def inspect(self, pdp):
-        if self.__squelch >= pdp.meta["dB"]:
-            pdp.data = np.zeros(shape=pdp.data.shape)
+        isOpen = np.asarray(self.__squelch < pdp.meta["dB"])
+        if isOpen.ndim:
+            pdp.meta["ch_open"] = isOpen
+        if not isOpen.any():
+            # Drop the samples so later stages can skip their work, they only need to know how many there were
+            pdp.meta["num_samples"] = pdp.data.shape[-1]
+            pdp.data = None
             pdp.meta["squelched"] = True
         else:
-            pdp.meta["squelched"] = False
\ No newline at end of file
+            pdp.meta["squelched"] = False
+
+CHANNEL = "channel"
+def build_chain(source, params, audioPool, toSpeakers, toHW = None, scanner = None, record = None, recordAll = False, dropOldest = True):
+    """
+    The decoding chain main runs, as (stage, placement) pairs from source to Endpoint.
+    Stages placed on CHANNEL (the full rate channel filter and decimator, or the
+    channelizer) get a process of their own, every other stage either needs something
+    that only lives in the main process (dongle, speaker queue) or is cheap.
+
+    toSpeakers.feed() gets every audio block (and hands it back to audioPool), toHW
+    the meta of each. The source drops its oldest chunks when the chain can't keep
+    up, unless dropOldest is off (a file replayed as fast as possible).
+    """
+    retuner = params["sdr_retuner"].get()
+    if params["sdr_channels"].get():
+        # Many channels out of one capture: squelch and demodulate them all, then pick one to hear
+        front = [
+            (record                                                                                   , None   ),
+            (DropStale(retuner)                                                                       , None   ),
+            (FineTune(params["sdr_fs"])                                                               , CHANNEL),
+            (Channelize(params["sdr_channels"], params["sdr_cf"], params["sdr_fs"],
+                        params["sdr_dig_bw"])                                                         , CHANNEL),
+            (MeasurePower(PowerEstimator.EWMA)                                                        , CHANNEL),
+            (ApplySquelch(params["sdr_squelch"])                                                      , CHANNEL),
+            (DemodulateRF(params["sdr_decoder"])                                                      , None   ),
+            (MixChannels()                                                                            , None   ),
+        ]
+    elif scanner is not None:
+        # Squelch on the channel being scanned, after it's been picked out of the capture. Measured across
+        # the whole capture every channel in it would break squelch together. The squelch decision
+        # comes too late to record on, so the capture is recorded whole. FineTune mixes each chunk by
+        # the offset it was captured with, so chunks from before a retune still measure their own channel.
+        front = [
+            (StampTuning(scanner, retuner, params["sdr_fs"])                                          , None   ),
+            (record                                                                                   , None   ),
+            (FineTune(params["sdr_fs"])                                                               , CHANNEL),
+            (Filter(params["sdr_lp_sos"])                                                             , CHANNEL),
+            (Decimate(params["sdr_fs"], params["sdr_dig_bw"])                                         , CHANNEL),
+            # Averaging across chunks would carry power over from the last channel
+            (MeasurePower(PowerEstimator.RMS)                                                         , CHANNEL),
+            (ApplySquelch(params["sdr_squelch"])                                                      , CHANNEL),
+            # The scanner has usually moved on by now, its verdict on the channel it left still counts
+            (ReportSquelch(scanner)                                                                   , None   ),
+            (DropStale(retuner)                                                                       , None   ),
+            (DemodulateRF(params["sdr_decoder"])                                                      , None   ),
+        ]
+    else:
+        front = [
+            (MeasurePower(PowerEstimator.EWMA, stride=4)                                              , None   ),
+            (record if recordAll else None                                                            , None   ),
+            (ApplySquelch(params["sdr_squelch"])                                                      , None   ),
+            (record if not recordAll else None                                                        , None   ),
+            (DropStale(retuner)                                                                       , None   ),
+            (FineTune(params["sdr_fs"])                                                               , CHANNEL),
+            # (DEBUG_SAVE_TO_FILE(f"./logs/pre_filt_{time.strftime('%d-%H-%M-%S')}.iq")              , None   ),
+            (Filter(params["sdr_lp_sos"])                                                             , CHANNEL),
+            # (DEBUG_SAVE_TO_FILE(f"./logs/post_filt_{time.strftime('%d-%H-%M-%S')}.iq")             , CHANNEL),
+            (Decimate(params["sdr_fs"], params["sdr_dig_bw"])                                         , CHANNEL),
+            (DemodulateRF(params["sdr_decoder"])                                                      , None   ),
+        ]
+    chain = [
+        # Stage                                                                                     Placement
+        (source                                                                                   , None   ),
+        (StampGeneration(retuner, params["sdr_fs"])                                               , None   ),
+        *front,
+        (Downsample(params["sdr_fs"], params["spkr_fs"])                                          , None   ),
+        (RechunkArray(params["spkr_chunk_sz"], np.float32, audioPool)                             , None   ),
+        (AdjustVolume(params["spkr_volume"])                                                      , None   ),
+        (DropStale(retuner, onDrop=lambda d : audioPool.release(d.data), markHeard=True)          , None   ),
+
+        # Data is now audio ready for speakers
+        (FxApplyWindow(lambda d : toSpeakers.feed(d.data, d.captureTime))                         , None   ),
+        (FxApplyWindow(lambda d : toHW.put(d.meta)) if toHW is not None else None                 , None   ),
+        (Endpoint()                                                                               , None   ),
+    ]
+    chain = [(stage, placement) for stage, placement in chain if stage is not None]
+
+    # Bound every edge so a slow stage can't pile up latency without limit. Stages push back on each
+    # other all the way up to the dongle, which drops its oldest chunks instead so we stay near real time.
+    for stage, _ in chain[1:]:
+        if isinstance(stage, BaseProducer):
+            stage.set_outbox_policy(4, DropPolicy.BLOCK)
+    source.set_outbox_policy(8, DropPolicy.DROP_OLDEST if dropOldest else DropPolicy.BLOCK)
+    return chain
\ No newline at end of file